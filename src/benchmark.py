@@ -0,0 +1,240 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+''' Headless playback engine benchmark.
+
+Runs the same trigger path as a click on a clip (Playsoundy.play_pause) but
+renders into fakesinks, so no sound card is needed. Results are printed, or
+written with --output, as JSON so runs against different engine settings can
+be compared:
+
+    python3 -m soundjam.benchmark --engine mixer --output mixer.json
+'''
+
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+from threading import Event, Lock
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from .clips import Clip, close_clips
+from .mixer import Mixer, MixerVoice
+from .playsoundy import Voice, VoicePool
+from .samplecache import SampleCache
+
+class SinkProbe():
+    ''' Builds fakesinks reporting when audible buffers are rendered and how late they were '''
+
+    def __init__(self, late_threshold=20 * Gst.MSECOND, *args, **kwargs):
+
+        self.late_threshold = late_threshold
+        self.lock = Lock()
+        self.first_buffer = Event()
+        self.first_buffer_time = 0
+        self.late_buffers = 0
+        self.buffers = 0
+
+    def make_sink(self):
+        sink = Gst.ElementFactory.make("fakesink", None)
+        sink.props.sync = True
+        sink.props.signal_handoffs = True
+        sink.connect("handoff", self.on_handoff)
+        return sink
+
+    def reset(self):
+        with self.lock:
+            self.first_buffer.clear()
+            self.first_buffer_time = 0
+            self.late_buffers = 0
+            self.buffers = 0
+
+    def on_handoff(self, sink, buffer, pad):
+        now = time.perf_counter()
+        lateness = self.get_lateness(sink, buffer, pad)
+        with self.lock:
+            self.buffers += 1
+            if lateness is not None and lateness > self.late_threshold:
+                self.late_buffers += 1
+            if not self.first_buffer.is_set() and self.is_audible(buffer):
+                self.first_buffer_time = now
+                self.first_buffer.set()
+
+    def get_lateness(self, sink, buffer, pad):
+        clock = sink.get_clock()
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if clock is None or event is None or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return None
+        running_time = event.parse_segment().to_running_time(Gst.Format.TIME, buffer.pts)
+        return clock.get_time() - sink.get_base_time() - running_time
+
+    def is_audible(self, buffer):
+        # the mixer engine renders silence between triggers, only count the clip itself
+        return len(buffer.extract_dup(0, buffer.get_size()).strip(b"\x00")) > 0
+
+
+def generate_clip(path, duration):
+    pipeline = Gst.parse_launch("audiotestsrc wave=sine num-buffers={0} samplesperbuffer=480 ! audio/x-raw,rate=48000,channels=2 ! audioconvert ! wavenc ! filesink name=sink".format(int(duration * 100)))
+    pipeline.get_by_name("sink").props.location = path
+    pipeline.set_state(Gst.State.PLAYING)
+    pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    return GLib.filename_to_uri(path, None)
+
+def wait_for(predicate, timeout):
+    context = GLib.MainContext.default()
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        if not context.iteration(False):
+            time.sleep(0.001)
+    return True
+
+def get_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100.0 * len(ordered)) - 1)]
+
+def summarize(samples):
+    return {
+        "samples": len(samples),
+        "mean_ms": sum(samples) / len(samples) if samples else None,
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+    }
+
+
+class Benchmark():
+
+    def __init__(self, engine, policy, iterations, max_voices, timeout, *args, **kwargs):
+
+        self.iterations = iterations
+        self.max_voices = max_voices
+        self.timeout = timeout
+        self.probe = SinkProbe()
+        self.pool = VoicePool(polyphony=max_voices, policy=policy, engine=engine, audio_sink=self.probe.make_sink)
+        self.workdir = tempfile.TemporaryDirectory(prefix="soundjam-benchmark-")
+        self.uri = generate_clip(os.path.join(self.workdir.name, "clip.wav"), 0.5)
+
+    def measure_trigger(self, clip):
+        self.probe.reset()
+        started = time.perf_counter()
+        clip.player.play_pause()
+        if not wait_for(self.probe.first_buffer.is_set, self.timeout):
+            clip.player.stop()
+            return None
+        latency = (self.probe.first_buffer_time - started) * 1000
+        clip.player.stop()
+        wait_for(lambda: not clip.player.playing, self.timeout)
+        return latency
+
+    def run_latency(self, cache):
+        clip = Clip(self.uri, pool=self.pool, cache=cache)
+        if cache.budget > 0:
+            cache.request(self.uri)
+            wait_for(lambda: self.uri not in cache.pending, self.timeout)
+        latencies = [self.measure_trigger(clip) for i in range(self.iterations)]
+        return summarize([latency for latency in latencies if latency is not None])
+
+    def run_polyphony(self):
+        cache = SampleCache(budget=0)
+        max_clean = 0
+        voices = 1
+        while voices <= self.max_voices:
+            clips = [Clip(self.uri, pool=self.pool, cache=cache) for i in range(voices)]
+            self.probe.reset()
+            for clip in clips:
+                clip.player.play()
+            wait_for(lambda: not any(clip.player.playing for clip in clips), self.timeout)
+            for clip in clips:
+                clip.player.stop()
+            if self.probe.late_buffers > 0:
+                break
+            max_clean = voices
+            voices *= 2
+        return {"max_voices_without_underrun": max_clean, "tested_up_to": min(voices, self.max_voices)}
+
+    def run_memory(self, count=1000):
+        # a fresh pool so voices created by the earlier runs are not reused
+        pool = VoicePool(polyphony=self.pool.polyphony, policy=self.pool.policy, engine=self.pool.engine, audio_sink=self.probe.make_sink)
+        cache = SampleCache(budget=0)
+        live = Voice.live + MixerVoice.live
+        live_pipelines = Voice.live + Mixer.live
+        before = get_rss()
+        clips = [Clip(self.uri, pool=pool, cache=cache) for i in range(count)]
+        idle = (get_rss() - before) / count
+
+        before = get_rss()
+        voices = min(count, pool.polyphony)
+        for clip in clips[:voices]:
+            clip.player.play()
+        wait_for(lambda: not any(clip.player.playing for clip in clips[:voices]), self.timeout)
+        for clip in clips[:voices]:
+            clip.player.stop()
+        per_voice = (get_rss() - before) / voices
+
+        # everything the pool created must be gone once the clips and the pool are closed
+        close_clips(clips)
+        pool.close()
+        return {
+            "idle_clip_bytes": idle,
+            "voice_bytes": per_voice,
+            "leaked_voices": Voice.live + MixerVoice.live - live,
+            "leaked_pipelines": Voice.live + Mixer.live - live_pipelines,
+        }
+
+    def run(self):
+        return {
+            "gstreamer": Gst.version_string(),
+            "engine": self.pool.engine,
+            "policy": self.pool.policy,
+            "iterations": self.iterations,
+            "latency": {
+                "uncached": self.run_latency(SampleCache(budget=0)),
+                "cached": self.run_latency(SampleCache()),
+            },
+            "polyphony": self.run_polyphony(),
+            "memory": self.run_memory(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure soundjam trigger latency, polyphony and memory without a sound card")
+    parser.add_argument("--engine", choices=[VoicePool.ENGINE_VOICES, VoicePool.ENGINE_MIXER], default=VoicePool.ENGINE_VOICES)
+    parser.add_argument("--policy", choices=[VoicePool.POLICY_STOP, VoicePool.POLICY_PARK, VoicePool.POLICY_WARM], default=VoicePool.POLICY_STOP)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-voices", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    Gst.init(None)
+    report = Benchmark(args.engine, args.policy, args.iterations, args.max_voices, args.timeout).run()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
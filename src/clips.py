@@ -0,0 +1,183 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import os
+
+from gi.repository import GObject, GLib
+
+from .playsoundy import Playsoundy
+from .samplecache import SampleCache
+from .metadata import MetadataService
+from .waveform import PeakStore
+from .instrumentation import Instrumentation
+
+class Clip():
+    ''' A soundboard clip: its uri, metadata, cached analysis, playback state and player.
+
+    Plain slotted data without GObject or GTK, so the import, engine and
+    control paths can hold thousands of them cheaply. When a ClipItem is
+    attached to it, every change is passed on for the tiles to render.
+    '''
+
+    __slots__ = ("uri", "digest", "settings", "name", "metadata", "loudness", "peaks", "playing", "progress", "loop", "player", "item")
+
+    # normalization boosts quiet clips by at most 12 dB
+    MAX_VOLUME = 4.0
+
+    def __init__(self, uri, digest=None, settings=None, pool=None, cache=None, *args, **kwargs):
+
+        path, hostname = GLib.filename_from_uri(uri)
+        self.uri = uri
+        self.digest = digest
+        self.settings = settings or {}
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.metadata = None
+        self.loudness = None
+        self.peaks = None
+        self.playing = False
+        self.progress = 0.0
+        self.loop = False
+        self.item = None
+        self.player = Playsoundy(self, pool=pool, cache=cache)
+        self.set_loop(self.settings.get("loop", False))
+
+    def changed(self, name):
+        if self.item is not None:
+            self.item.on_clip_changed(name)
+
+    def set_playing(self, playing):
+        if self.playing != playing:
+            self.playing = playing
+            self.changed("playing")
+
+    def set_metadata(self, metadata):
+        if metadata is not None:
+            self.metadata = metadata
+            self.changed("metadata")
+
+    def set_progress(self, progress):
+        if self.progress != progress:
+            self.progress = progress
+            self.changed("progress")
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.changed("peaks")
+
+    def set_loop(self, loop, loop_in=None, loop_out=None):
+        ''' Loops the clip between loop_in and loop_out in ns, points left as None are kept '''
+        loop_in = self.settings.get("loop-in", 0) if loop_in is None else loop_in
+        loop_out = self.settings.get("loop-out", -1) if loop_out is None else loop_out
+        if loop or loop_in > 0 or loop_out >= 0:
+            self.settings.update({"loop": loop, "loop-in": loop_in, "loop-out": loop_out})
+        else:
+            for key in ("loop", "loop-in", "loop-out"):
+                self.settings.pop(key, None)
+        self.player.set_loop(loop, loop_in, loop_out)
+        if self.loop != loop:
+            self.loop = loop
+            self.changed("loop")
+
+    def set_loudness(self, loudness):
+        self.loudness = loudness
+
+    def get_volume(self, normalize=True):
+        ''' Returns the linear volume bringing the clip to the reference loudness without clipping its peak '''
+        if not normalize or self.loudness is None:
+            return 1.0
+        volume = 10 ** (self.loudness["gain"] / 20)
+        if self.loudness["peak"] > 0:
+            volume = min(volume, 1.0 / self.loudness["peak"])
+        return min(volume, self.MAX_VOLUME)
+
+    def get_description(self):
+        metadata = self.metadata
+        if metadata is None:
+            return self.name
+        details = []
+        if metadata["duration"] > 0:
+            minutes, seconds = divmod(metadata["duration"] / 1000000000, 60)
+            details.append("{0}:{1:04.1f}".format(int(minutes), seconds))
+        if metadata["codec"]:
+            details.append(metadata["codec"])
+        if metadata["channels"]:
+            details.append("{0} ch".format(metadata["channels"]))
+        if metadata["rate"]:
+            details.append("{0:g} kHz".format(metadata["rate"] / 1000))
+        return "{0}\n{1}".format(self.name, " · ".join(details))
+
+    def to_entry(self):
+        return {"uri": self.uri, "digest": self.digest, "settings": self.settings}
+
+    def close(self):
+        ''' Stops the clip for good and breaks its reference cycles with the player and the item '''
+        self.player.close()
+        self.item = None
+
+
+def close_clips(clips, uris=None):
+    ''' Releases everything held for clips leaving the board, in one pass for batch removals.
+
+    Their voices are stopped and given back to the pool, parked ones included,
+    their decoded samples, peaks, pending analysis and statistics are dropped
+    and the clips are closed. Those are shared by uri, uris limits which are
+    dropped when other clips still use some of them, all by default.
+    '''
+    clips = list(clips)
+    if uris is None:
+        uris = [clip.uri for clip in clips]
+    players = [clip.player for clip in clips]
+    for pool in {player.pool for player in players if player.pool is not None}:
+        pool.remove(players)
+    for cache in {player.cache or SampleCache.get_default() for player in players}:
+        cache.discard(uris)
+    MetadataService.get_default().forget(uris)
+    PeakStore.get_default().forget(uris)
+    Instrumentation.get_default().forget(uris)
+    for clip in clips:
+        clip.close()
+
+
+class ClipItem(GObject.Object):
+    ''' A Clip as an entry in the board's Gio.ListStore.
+
+    Mirrors the clip state tiles render as GObject properties to bind and
+    notify on, tiles can be created, recycled and destroyed while the clip
+    keeps playing. Items without a clip are the empty placeholder cells.
+    '''
+    __gtype_name__ = 'ClipItem'
+
+    playing = GObject.Property(type=bool, default=False)
+    metadata = GObject.Property(type=object)
+    peaks = GObject.Property(type=object)
+    progress = GObject.Property(type=float, default=0.0)
+    loop = GObject.Property(type=bool, default=False)
+
+    MIRRORED = ("playing", "metadata", "peaks", "progress", "loop")
+
+    def __init__(self, clip=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.clip = clip
+        if clip is not None:
+            clip.item = self
+            for name in self.MIRRORED:
+                self.on_clip_changed(name)
+
+    @property
+    def placeholder(self):
+        return self.clip is None
+
+    @property
+    def uri(self):
+        return self.clip.uri if self.clip is not None else None
+
+    @property
+    def name(self):
+        return self.clip.name if self.clip is not None else None
+
+    def on_clip_changed(self, name):
+        self.set_property(name, getattr(self.clip, name))
+
+    def get_description(self):
+        return self.clip.get_description()
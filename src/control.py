@@ -0,0 +1,229 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import argparse
+import json
+import os
+import socket
+import sys
+import traceback
+
+from gi.repository import GLib, Gio
+
+from .instrumentation import Instrumentation
+
+APP_ID = "com.github.hezral.soundjam"
+
+def get_socket_path(app_id=None):
+    ''' Returns where the control socket lives, in the app's shared runtime dir when app_id is given or sandboxed '''
+    app_id = app_id or os.environ.get("FLATPAK_ID")
+    if app_id:
+        # $XDG_RUNTIME_DIR/app/<app id> is the part of the sandbox runtime dir the host sees too
+        return os.path.join(GLib.get_user_runtime_dir(), "app", app_id, "control.sock")
+    return os.path.join(GLib.get_user_runtime_dir(), "soundjam", "control.sock")
+
+
+def find_socket_path():
+    ''' Returns the socket of a running soundjam, installed natively or as the Flatpak '''
+    paths = [get_socket_path(), get_socket_path(APP_ID)]
+    return next((path for path in paths if os.path.exists(path)), paths[0])
+
+
+class ControlServer():
+    ''' Local control API for triggering clips from other processes.
+
+    Listens on a Unix socket in the user runtime dir, at
+    $XDG_RUNTIME_DIR/soundjam/control.sock or, inside the Flatpak, at
+    $XDG_RUNTIME_DIR/app/com.github.hezral.soundjam/control.sock where
+    host processes can reach it. Requests and responses are JSON objects, one
+    per line, and every request gets one response in order. Requests are handled right on the main loop as they arrive, going
+    through the same path as a click on a tile.
+
+        {"cmd": "trigger", "clip": 3}
+        {"cmd": "trigger", "clips": [0, 4, "file:///home/user/cue.wav"]}
+        {"cmd": "loop", "clip": 3, "loop": true, "in": 500000000, "out": 2000000000}
+        {"cmd": "stop-all"}
+        {"cmd": "status"}
+        {"cmd": "stats"}
+
+    Clips are given by id, their position on the board as listed by status,
+    or by uri. Loop points are in ns, left out they are kept and -1 as out
+    loops to the end. Responses are {"ok": true, ...} or {"ok": false, "error": ...}.
+    '''
+
+    def __init__(self, window, path=None, *args, **kwargs):
+
+        self.window = window
+        self.path = path or get_socket_path()
+        self.service = None
+        self.connections = set()
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.service = Gio.SocketService()
+        try:
+            self.service.add_address(Gio.UnixSocketAddress.new(self.path), Gio.SocketType.STREAM, Gio.SocketProtocol.DEFAULT, None)
+        except GLib.Error as error:
+            print("Control socket unavailable: %s" % error.message)
+            self.service = None
+            return False
+        self.service.connect("incoming", self.on_incoming)
+        self.service.start()
+        return True
+
+    def stop(self):
+        if self.service is None:
+            return
+        self.service.stop()
+        self.service.close()
+        self.service = None
+        for connection in list(self.connections):
+            connection.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def on_incoming(self, service, socket_connection, source_object):
+        ControlConnection(self, socket_connection).read()
+        return False
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "request must be an object"}
+        command = request.get("cmd")
+        if command == "trigger":
+            clips = request.get("clips")
+            if clips is None:
+                clips = [request.get("clip")]
+            if not isinstance(clips, list):
+                return {"ok": False, "error": "clips must be a list"}
+            missing = [clip for clip in clips if not self.window.trigger_soundclip(self.get_uri(clip))]
+            if missing:
+                return {"ok": False, "error": "unknown clips", "clips": missing}
+            return {"ok": True}
+        if command == "loop":
+            for key in ("in", "out"):
+                if not self.is_integer(request.get(key)) and request.get(key) is not None:
+                    return {"ok": False, "error": "{0} must be an integer in ns".format(key)}
+            item = self.window.get_soundclip(self.get_uri(request.get("clip")))
+            if item is None:
+                return {"ok": False, "error": "unknown clip", "clips": [request.get("clip")]}
+            item.clip.set_loop(bool(request.get("loop", True)), request.get("in"), request.get("out"))
+            return {"ok": True}
+        if command == "stop-all":
+            return {"ok": True, "stopped": self.window.stop_soundclips()}
+        if command == "status":
+            return dict(ok=True, **self.window.get_status())
+        if command == "stats":
+            return {"ok": True, "stats": Instrumentation.get_default().snapshot()}
+        return {"ok": False, "error": "unknown command {0!r}".format(command)}
+
+    def is_integer(self, value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def get_uri(self, clip):
+        if self.is_integer(clip):
+            item = self.window.get_soundclip_at(clip)
+            return item.uri if item is not None else None
+        if isinstance(clip, str):
+            return clip
+        return None
+
+
+class ControlConnection():
+    ''' One client of the ControlServer, reads requests line by line without blocking the main loop '''
+
+    def __init__(self, server, socket_connection, *args, **kwargs):
+
+        self.server = server
+        self.socket_connection = socket_connection
+        self.input = Gio.DataInputStream.new(socket_connection.get_input_stream())
+        self.output = socket_connection.get_output_stream()
+
+    def read(self):
+        self.server.connections.add(self)
+        self.input.read_line_async(GLib.PRIORITY_HIGH, None, self.on_read_line)
+
+    def on_read_line(self, stream, result):
+        try:
+            line, length = stream.read_line_finish_utf8(result)
+        except GLib.Error:
+            line = None
+        if line is None:
+            self.close()
+            return
+
+        if line.strip():
+            try:
+                response = self.server.handle(json.loads(line))
+            except ValueError as error:
+                response = {"ok": False, "error": str(error)}
+            except Exception as error:
+                # a bad request must still get its response, or the client waits forever
+                traceback.print_exc()
+                response = {"ok": False, "error": "{0}: {1}".format(type(error).__name__, error)}
+            try:
+                self.output.write_all((json.dumps(response, separators=(",", ":")) + "\n").encode("utf-8"), None)
+            except GLib.Error:
+                self.close()
+                return
+
+        self.input.read_line_async(GLib.PRIORITY_HIGH, None, self.on_read_line)
+
+    def close(self):
+        self.server.connections.discard(self)
+        self.socket_connection.close(None)
+
+
+def send(requests, path=None):
+    ''' Sends requests to a running soundjam and returns their responses, for scripts and testing '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path or find_socket_path())
+        client.sendall("".join(json.dumps(request) + "\n" for request in requests).encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile("r", encoding="utf-8") as responses:
+            return [json.loads(line) for line in responses]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="soundjam.control", description="Control a running soundjam")
+    parser.add_argument("--socket", default=None, help="control socket path, found in the user runtime dir by default")
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    trigger = subparsers.add_parser("trigger", help="trigger clips by id or uri, all in one batch")
+    trigger.add_argument("clips", nargs="+")
+    loop = subparsers.add_parser("loop", help="loop a clip, optionally between two points")
+    loop.add_argument("clip")
+    loop.add_argument("--off", action="store_true", help="stop looping")
+    loop.add_argument("--in", dest="loop_in", type=float, default=None, help="loop start in seconds")
+    loop.add_argument("--out", dest="loop_out", type=float, default=None, help="loop end in seconds")
+    subparsers.add_parser("stop-all", help="stop every playing clip")
+    subparsers.add_parser("status", help="list clips and playing voices")
+    subparsers.add_parser("stats", help="engine and per clip latency statistics")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "trigger":
+        request = {"cmd": "trigger", "clips": [int(clip) if clip.isdigit() else clip for clip in args.clips]}
+    elif args.cmd == "loop":
+        request = {"cmd": "loop", "clip": int(args.clip) if args.clip.isdigit() else args.clip, "loop": not args.off}
+        if args.loop_in is not None:
+            request["in"] = int(args.loop_in * 1000000000)
+        if args.loop_out is not None:
+            request["out"] = int(args.loop_out * 1000000000)
+    else:
+        request = {"cmd": args.cmd}
+
+    try:
+        response, = send([request], args.socket)
+    except (OSError, ValueError) as error:
+        print("soundjam isn't reachable: %s" % error, file=sys.stderr)
+        return 1
+    print(json.dumps(response, indent=2))
+    return 0 if response.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,9 @@ from gi.repository import Handy, Gtk, GObject, Gio, Granite, Gdk, cairo, PangoCa
 
 import math
 
+# pycairo, to draw offscreen, the gi cairo module above only carries the enums
+import cairo as pycairo
+
 class CircularProgressBar(Gtk.Bin):
     '''Ported from https://github.com/phastmike/vala-circular-progress-bar'''
     MIN_D = 80
@@ -25,26 +28,80 @@ class CircularProgressBar(Gtk.Bin):
     _progress_fill_color = "#4a90d9"
 
     center_filled = GObject.Property(type=bool, default=False)
+    show_text = GObject.Property(type=bool, default=True)
     radius_filled = GObject.Property(type=bool, default=False)
     font = GObject.Property(type=str, default="Inter")
     line_cap = GObject.Property(type=cairo.LineCap, default=cairo.LineCap.BUTT)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, size=300, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        self.MIN_D = min(self.MIN_D, size)
+
+        # render caches, rebuilt only when size, style or appearance properties change
+        self._rgba = {}
+        self._text_rgba = None
+        self._background = None
+        self._background_size = None
+        self._value_layout = None
+        self._unit_layout = None
+        self._displayed_percentage = -1
+
         drawing_area = Gtk.DrawingArea()
-        drawing_area.set_size_request(300, 300)
+        drawing_area.set_size_request(size, size)
         drawing_area.props.expand = True
         drawing_area.props.halign = self.props.valign = Gtk.Align.FILL
 
         drawing_area.connect("draw", self.draw)
         self.connect("notify", self.on_notify)
+        self.connect("style-updated", self.on_style_updated)
+        self.connect("screen-changed", self.on_style_updated)
 
         self.add(drawing_area)
 
-    def on_notify(self, *args):
+    def on_notify(self, widget, pspec):
+        if pspec.name == "percentage":
+            # the ring is redrawn only when the displayed whole percent changes
+            if int(self.percentage * 100.0) == self._displayed_percentage:
+                return
+        elif pspec.name == "font":
+            self._value_layout = self._unit_layout = None
+        else:
+            self._background = None
+        self.queue_draw()
+
+    def on_style_updated(self, *args):
+        self._text_rgba = None
+        self._background = None
+        self._value_layout = self._unit_layout = None
         self.queue_draw()
 
+    def get_rgba(self, value):
+        rgba = self._rgba.get(value)
+        if rgba is None:
+            rgba = Gdk.RGBA()
+            rgba.parse(value)
+            self._rgba[value] = rgba
+        return rgba
+
+    def get_layouts(self):
+        if self._value_layout is None:
+            self._value_layout = self.create_pango_layout(None)
+            self._value_layout.set_font_description(Pango.FontDescription.from_string(self.font + " 24"))
+            self._unit_layout = self.create_pango_layout("PERCENT")
+            self._unit_layout.set_font_description(Pango.FontDescription.from_string(self.font + " 8"))
+            self._displayed_percentage = -1
+        return self._value_layout, self._unit_layout
+
+    def get_text_rgba(self):
+        if self._text_rgba is None:
+            context = self.get_style_context()
+            context.save()
+            context.add_class(Gtk.STYLE_CLASS_TROUGH)
+            self._text_rgba = context.get_color(context.get_state())
+            context.restore()
+        return self._text_rgba
+
     @GObject.Property(type=str)
     def center_fill_color(self):
         '''Center pad fill color (Check Gdk.RGBA parse method)'''
@@ -138,10 +195,10 @@ class CircularProgressBar(Gtk.Bin):
 
         cr.save()
 
-        color = Gdk.RGBA()
-
-        center_x = self.get_allocated_width() / 2
-        center_y = self.get_allocated_height() / 2
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        center_x = width / 2
+        center_y = height / 2
         radius =  self.calculate_radius()
 
         if radius - self.line_width < 0:
@@ -150,29 +207,39 @@ class CircularProgressBar(Gtk.Bin):
         else:
             delta = radius - (self.line_width / 2)
 
-        color = Gdk.RGBA()
-
         cr.set_line_cap(self.line_cap)
         cr.set_line_width(self.line_width)
 
-        # Center Fill
-        if self.center_filled:
-            cr.arc(center_x, center_y, delta, 0, 2 * math.pi)
-            color.parse(self.center_fill_color)
-            Gdk.cairo_set_source_rgba(cr, color)
-            cr.fill()
-
-        # Radius Fill
-        if self.radius_filled:
-            cr.arc(center_x, center_y, delta, 0, 2 * math.pi)
-            color.parse(self.radius_fill_color)
-            Gdk.cairo_set_source_rgba(cr, color)
-            cr.stroke()
+        # Center and radius fills only change with size or style, keep them rendered offscreen.
+        # The surface covers the whole allocation, a partial expose mustn't leave a cropped ring cached
+        background_size = (width, height, self.get_scale_factor())
+        if self._background is None or self._background_size != background_size:
+            # similar surfaces inherit the device scale, so HiDPI rings stay sharp
+            self._background = cr.get_target().create_similar(pycairo.Content.COLOR_ALPHA, width, height)
+            background = pycairo.Context(self._background)
+            background.set_line_cap(self.line_cap)
+            background.set_line_width(self.line_width)
+
+            # Center Fill
+            if self.center_filled:
+                background.arc(center_x, center_y, delta, 0, 2 * math.pi)
+                Gdk.cairo_set_source_rgba(background, self.get_rgba(self.center_fill_color))
+                background.fill()
+
+            # Radius Fill
+            if self.radius_filled:
+                background.arc(center_x, center_y, delta, 0, 2 * math.pi)
+                Gdk.cairo_set_source_rgba(background, self.get_rgba(self.radius_fill_color))
+                background.stroke()
+
+            self._background_size = background_size
+
+        cr.set_source_surface(self._background, 0, 0)
+        cr.paint()
 
         # Progress/Percentage Fill
         if self.percentage > 0:
-            color.parse(self.progress_fill_color)
-            Gdk.cairo_set_source_rgba(cr, color)
+            Gdk.cairo_set_source_rgba(cr, self.get_rgba(self.progress_fill_color))
 
             if self.line_width == 0:
                 cr.move_to(center_x, center_y)
@@ -182,33 +249,30 @@ class CircularProgressBar(Gtk.Bin):
                 cr.arc(center_x, center_y, delta, 1.5 * math.pi, (1.5 + self.percentage * 2 ) * math.pi)
                 cr.stroke()
 
+        displayed_percentage = int(self.percentage * 100.0)
+
+        if not self.show_text:
+            self._displayed_percentage = displayed_percentage
+            cr.restore()
+            return
+
         # Textual information
-        context = self.get_style_context()
-        context.save()
-        context.add_class(Gtk.STYLE_CLASS_TROUGH)
-        color = context.get_color(context.get_state())
-        Gdk.cairo_set_source_rgba(cr, color)
+        Gdk.cairo_set_source_rgba(cr, self.get_text_rgba())
+        value_layout, unit_layout = self.get_layouts()
 
         # Percentage
-        layout = PangoCairo.create_layout(cr)
-        layout.set_text("{0}".format(int(self.percentage * 100.0)), -1)
-        desc = Pango.FontDescription.from_string(self.font + " 24")
-        layout.set_font_description(desc)
-        PangoCairo.update_layout(cr, layout)
-        w, h = layout.get_size() 
+        if displayed_percentage != self._displayed_percentage:
+            value_layout.set_text("{0}".format(displayed_percentage), -1)
+        self._displayed_percentage = displayed_percentage
+        w, h = value_layout.get_size()
         cr.move_to(center_x - ((w / Pango.SCALE) / 2), center_y - 27 )
-        PangoCairo.show_layout(cr, layout)
+        PangoCairo.show_layout(cr, value_layout)
 
         # Units indicator ('PERCENT')
-        layout.set_text("PERCENT", -1)
-        desc = Pango.FontDescription.from_string(self.font + " 8")
-        layout.set_font_description(desc)
-        PangoCairo.update_layout(cr, layout)
-        w, h = layout.get_size()
+        w, h = unit_layout.get_size()
         cr.move_to(center_x - ((w / Pango.SCALE) / 2), center_y + 13)
-        PangoCairo.show_layout(cr, layout)
+        PangoCairo.show_layout(cr, unit_layout)
 
-        context.restore()
         cr.restore()
 
         # return self.draw(cr)
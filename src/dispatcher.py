@@ -0,0 +1,60 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+from gi.repository import GLib
+
+class BusDispatcher(GLib.Source):
+    ''' One main loop source for the buses of every pipeline in the engine.
+
+    Each registered bus contributes its poll fd to this single source, so
+    the main loop cost doesn't grow with a GSource per voice. When a bus
+    wakes up, its messages are popped with the types it was registered for.
+    Other messages are discarded by GStreamer without reaching Python, and
+    the rest go to the bus handler from the routes table.
+    '''
+
+    default = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+        self.routes = {}
+        self.set_name("soundjam-bus-dispatcher")
+        self.attach(None)
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    def add(self, bus, message_types, handler):
+        ''' Calls handler(bus, message) on the main loop for messages on bus matching message_types '''
+        self.remove(bus)
+        pollfd = bus.get_pollfd()
+        self.add_poll(pollfd)
+        self.routes[bus] = (pollfd, message_types, handler)
+
+    def remove(self, bus):
+        route = self.routes.pop(bus, None)
+        if route is not None:
+            self.remove_poll(route[0])
+
+    def prepare(self):
+        return False, -1
+
+    def check(self):
+        return any(pollfd.revents & GLib.IOCondition.IN for pollfd, message_types, handler in self.routes.values())
+
+    def dispatch(self, callback, args):
+        for bus, (pollfd, message_types, handler) in list(self.routes.items()):
+            if not pollfd.revents & GLib.IOCondition.IN:
+                continue
+            message = bus.pop_filtered(message_types)
+            while message is not None:
+                handler(bus, message)
+                # the handler may have unregistered the bus
+                if bus not in self.routes:
+                    break
+                message = bus.pop_filtered(message_types)
+        return GLib.SOURCE_CONTINUE
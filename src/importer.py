@@ -0,0 +1,146 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import hashlib
+import os
+from threading import Event
+
+from gi.repository import GLib, Gio
+
+from .utils import TaskExecutor
+
+def sniff(path):
+    ''' Returns True if path is a readable audio file, guessing from its name and first bytes '''
+    try:
+        with open(path, "rb") as file:
+            data = file.read(4096)
+    except OSError:
+        return False
+    mime_type, uncertain = Gio.content_type_guess(path, data)
+    return mime_type is not None and "audio" in mime_type
+
+def hash_content(path):
+    ''' Returns a digest of the file contents, or None if it can't be read '''
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class ImportJob():
+    ''' Imports dropped uris into the soundboard.
+
+    Directories are walked recursively on the TaskExecutor import lane and files
+    are sniffed in batches on the sniff lane, shared by every job and sized by
+    the first one's workers. Accepted clips, progress and completion are delivered on the main loop, in drop order, through the
+    on_clips(clips), on_progress(done, found) and on_done(cancelled) callbacks.
+    clips is a list of (uri, digest) pairs, digest is only computed when
+    hashing is enabled and is None otherwise.
+    '''
+
+    BATCH_SIZE = 64
+
+    def __init__(self, uris, on_clips, on_progress=None, on_done=None, workers=None, hashing=False, *args, **kwargs):
+
+        self.uris = uris
+        self.hashing = hashing
+        self.on_clips = on_clips
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.workers = workers or min(8, (os.cpu_count() or 1) * 2)
+        self.cancelled = Event()
+        self.future = None
+        self.found = 0
+        self.done = 0
+
+    def start(self):
+        # a lane of its own, so a drop doesn't wait behind the analysis of the whole board
+        self.future = TaskExecutor.get_lane("import").submit(self.run)
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None and self.future.cancel():
+            GLib.idle_add(self.finish)
+
+    def walk(self):
+        for uri in self.uris:
+            try:
+                path, hostname = GLib.filename_from_uri(uri)
+            except GLib.Error:
+                continue
+            if os.path.isdir(path):
+                yield from self.walk_directory(path)
+            elif os.path.isfile(path):
+                yield path
+
+    def walk_directory(self, path):
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if self.cancelled.is_set():
+                return
+            if entry.is_dir(follow_symlinks=False):
+                yield from self.walk_directory(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+    def run(self):
+        # the walker waits on this lane, so it mustn't be the one the walker runs on
+        lane = TaskExecutor.get_lane("sniff", workers=self.workers)
+        batch = []
+        for path in self.walk():
+            if self.cancelled.is_set():
+                break
+            batch.append(path)
+            self.found += 1
+            if len(batch) == self.BATCH_SIZE:
+                self.process(lane, batch)
+                batch = []
+        if batch and not self.cancelled.is_set():
+            self.process(lane, batch)
+        GLib.idle_add(self.finish)
+
+    def inspect(self, path):
+        if not sniff(path):
+            return None
+        if self.hashing:
+            return GLib.filename_to_uri(path, None), hash_content(path)
+        return GLib.filename_to_uri(path, None), None
+
+    def process(self, lane, paths):
+        futures = [lane.submit(self.inspect, path) for path in paths]
+        accepted = []
+        for future in futures:
+            # a cancelled job gives back the sniffs it hasn't started
+            if self.cancelled.is_set():
+                future.cancel()
+            try:
+                clip = future.result()
+            except Exception:
+                # cancelled, or failed and already printed by the executor
+                clip = None
+            if clip is not None:
+                accepted.append(clip)
+        self.done += len(paths)
+        if self.cancelled.is_set():
+            return
+        if accepted:
+            GLib.idle_add(self.deliver, accepted)
+        if self.on_progress is not None:
+            GLib.idle_add(self.on_progress, self.done, self.found)
+
+    def deliver(self, clips):
+        if not self.cancelled.is_set():
+            self.on_clips(clips)
+        return False
+
+    def finish(self):
+        if self.on_done is not None:
+            self.on_done(self.cancelled.is_set())
+        return False
@@ -0,0 +1,189 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import json
+import math
+import os
+import time
+from collections import defaultdict, deque
+from threading import Lock
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+class Stat():
+    ''' Running count, mean, min and max of a measurement, plus percentiles over the last SAMPLES values '''
+
+    SAMPLES = 256
+
+    def __init__(self, *args, **kwargs):
+
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=self.SAMPLES)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, percent):
+        ordered = sorted(self.samples)
+        return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class Instrumentation():
+    ''' Engine statistics for finding out why a trigger was slow.
+
+    Voices report when they are triggered, when their pipeline reaches
+    PLAYING, when the first buffer arrives at their sink and every bus
+    message routed to them. Timings are in ms, kept per clip and for the whole
+    engine: "NULL->PLAYING" for a cold start, "PAUSED->PLAYING" for a warm
+    voice and "first-buffer" from trigger to audio at the sink. QOS and
+    WARNING messages are counted as underruns. Gauges like the active
+    voice count are sampled when a snapshot is taken.
+
+    Set SOUNDJAM_STATS=<path> to dump snapshot() as JSON to path every
+    SOUNDJAM_STATS_INTERVAL seconds, 10 by default.
+    '''
+
+    default = None
+
+    def __init__(self, *args, **kwargs):
+
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.engine = defaultdict(Stat)
+        self.clips = defaultdict(lambda: defaultdict(Stat))
+        self.underruns = defaultdict(int)
+        self.messages = defaultdict(int)
+        self.gauges = {}
+        self.transitions = {}
+        self.first_buffers = {}
+        self.dump_path = None
+        self.dump_timeout_id = 0
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    def add_gauge(self, name, get_value):
+        self.gauges[name] = get_value
+
+    def record(self, uri, name, value):
+        with self.lock:
+            self.engine[name].add(value)
+            if uri is not None:
+                self.clips[uri][name].add(value)
+
+    def trigger(self, key, uri, transition):
+        ''' Starts timing a trigger of the voice key, transition names the state change it goes through '''
+        now = time.monotonic()
+        with self.lock:
+            self.transitions[key] = (uri, transition, now)
+            self.first_buffers[key] = (uri, now)
+
+    def state_reached(self, key):
+        with self.lock:
+            pending = self.transitions.pop(key, None)
+        if pending is not None:
+            uri, transition, started = pending
+            self.record(uri, transition, (time.monotonic() - started) * 1000)
+
+    def first_buffer(self, key):
+        ''' Called from the streaming thread when the first buffer of a trigger reaches the sink '''
+        with self.lock:
+            pending = self.first_buffers.pop(key, None)
+        if pending is not None:
+            uri, started = pending
+            self.record(uri, "first-buffer", (time.monotonic() - started) * 1000)
+
+    def cancel(self, key):
+        with self.lock:
+            self.transitions.pop(key, None)
+            self.first_buffers.pop(key, None)
+
+    def forget(self, uris):
+        ''' Drops the statistics of clips that are gone, engine totals are kept '''
+        with self.lock:
+            for uri in uris:
+                self.clips.pop(uri, None)
+                self.underruns.pop(uri, None)
+
+    def message(self, uri, message_type):
+        name = Gst.MessageType.get_name(message_type)
+        with self.lock:
+            self.messages[name] += 1
+            if name in ("qos", "warning"):
+                self.underruns[None] += 1
+                if uri is not None:
+                    self.underruns[uri] += 1
+
+    def snapshot(self):
+        uptime = time.monotonic() - self.started
+        gauges = {name: get_value() for name, get_value in self.gauges.items()}
+        with self.lock:
+            total = sum(self.messages.values())
+            return {
+                "time": time.time(),
+                "uptime": uptime,
+                "engine": {name: stat.summary() for name, stat in self.engine.items()},
+                "underruns": self.underruns[None],
+                "messages": dict(self.messages),
+                "message_rate": total / uptime if uptime > 0 else 0.0,
+                "gauges": gauges,
+                "clips": {
+                    uri: dict({name: stat.summary() for name, stat in stats.items()}, underruns=self.underruns.get(uri, 0))
+                    for uri, stats in self.clips.items()
+                },
+            }
+
+    def start_dumps(self, path, interval=10):
+        self.dump_path = path
+        if self.dump_timeout_id == 0:
+            self.dump_timeout_id = GLib.timeout_add_seconds(interval, self.on_dump_timeout)
+
+    def start_from_environment(self):
+        path = os.environ.get("SOUNDJAM_STATS")
+        if not path:
+            return
+        try:
+            interval = max(1, int(os.environ.get("SOUNDJAM_STATS_INTERVAL", 10)))
+        except ValueError:
+            interval = 10
+        self.start_dumps(path, interval)
+
+    def stop_dumps(self):
+        if self.dump_timeout_id > 0:
+            GLib.Source.remove(self.dump_timeout_id)
+            self.dump_timeout_id = 0
+            self.dump()
+
+    def dump(self):
+        try:
+            GLib.file_set_contents(self.dump_path, json.dumps(self.snapshot(), indent=2).encode("utf-8"))
+        except GLib.Error as error:
+            print("Couldn't write stats: %s" % error.message)
+
+    def on_dump_timeout(self):
+        self.dump()
+        return True
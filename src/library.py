@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import json
+import os
+
+from gi.repository import GLib
+
+class Library():
+    ''' The soundboard saved to disk between sessions.
+
+    The board is stored as compact JSON with the active bank and the clips
+    of every bank, one entry per clip in board order:
+    {"uri": ..., "digest": ..., "settings": {...}}. Version 1 libraries,
+    a single list of clips, are read as bank 0. Saves are debounced so a
+    burst of changes, like an import, results in a single write.
+    '''
+
+    VERSION = 2
+    BANKS = 10
+    SAVE_DELAY = 1
+
+    def __init__(self, path=None, *args, **kwargs):
+
+        self.path = path or os.path.join(GLib.get_user_data_dir(), "soundjam", "library.json")
+        self.save_timeout_id = 0
+        self.get_entries = None
+
+    def load(self):
+        ''' Returns the active bank and a list of BANKS entry lists '''
+        banks = [[] for bank in range(self.BANKS)]
+        try:
+            with open(self.path, "rb") as file:
+                library = json.loads(file.read())
+        except (OSError, ValueError):
+            return 0, banks
+        if not isinstance(library, dict):
+            return 0, banks
+        if library.get("version") == 1:
+            banks[0] = library.get("clips", [])
+            return 0, banks
+        if library.get("version") != self.VERSION:
+            return 0, banks
+        for bank, entries in enumerate(library.get("banks", [])[:self.BANKS]):
+            banks[bank] = entries
+        bank = library.get("bank", 0)
+        return bank if 0 <= bank < self.BANKS else 0, banks
+
+    def save(self, bank, banks):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = json.dumps({"version": self.VERSION, "bank": bank, "banks": banks}, separators=(",", ":"))
+        GLib.file_set_contents(self.path, data.encode("utf-8"))
+
+    def schedule_save(self, get_entries):
+        ''' get_entries() returns the active bank and the entry lists to save '''
+        self.get_entries = get_entries
+        if self.save_timeout_id == 0:
+            self.save_timeout_id = GLib.timeout_add_seconds(self.SAVE_DELAY, self.on_save_timeout)
+
+    def flush(self):
+        if self.save_timeout_id > 0:
+            GLib.Source.remove(self.save_timeout_id)
+            self.on_save_timeout()
+
+    def on_save_timeout(self):
+        self.save_timeout_id = 0
+        self.save(*self.get_entries())
+        return False
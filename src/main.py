@@ -3,6 +3,9 @@
 
 import sys
 import os
+
+from .startup import StartupProfile
+
 import gi
 
 gi.require_version('Gtk', '3.0')
@@ -11,8 +14,12 @@ gi.require_version('Granite', '1.0')
 from gi.repository import Gtk, Gio, Granite, Gdk
 
 from .window import soundjamWindow
+from .control import ControlServer
+from .instrumentation import Instrumentation
 from .utils import HelperUtils
 
+StartupProfile.get_default().mark("imports")
+
 class Application(Gtk.Application):
 
     granite_settings = Granite.Settings.get_default()
@@ -21,11 +28,15 @@ class Application(Gtk.Application):
     utils = HelperUtils()
 
     main_window = None
+    control_server = None
 
     def __init__(self):
         super().__init__(application_id='com.github.hezral.soundjam',
                          flags=Gio.ApplicationFlags.FLAGS_NONE)
 
+    def do_startup(self):
+        Gtk.Application.do_startup(self)
+
         prefers_color_scheme = self.granite_settings.get_prefers_color_scheme()
         self.gtk_settings.set_property("gtk-application-prefer-dark-theme", prefers_color_scheme)
         self.granite_settings.connect("notify::prefers-color-scheme", self.on_prefers_color_scheme)
@@ -40,11 +51,25 @@ class Application(Gtk.Application):
         if "io.elementary.stylesheet" not in self.gtk_settings.props.gtk_theme_name:
             self.gtk_settings.set_property("gtk-theme-name", "io.elementary.stylesheet.blueberry")
 
+        Instrumentation.get_default().start_from_environment()
+
+        StartupProfile.get_default().mark("application")
+
     def do_activate(self):
         if not self.main_window:
             self.main_window = soundjamWindow(application=self)
+            StartupProfile.get_default().mark("window")
+            if self.gio_settings.get_boolean("control-socket"):
+                self.control_server = ControlServer(self.main_window)
+                self.control_server.start()
         self.main_window.present()
 
+    def do_shutdown(self):
+        if self.control_server is not None:
+            self.control_server.stop()
+        Instrumentation.get_default().stop_dumps()
+        Gtk.Application.do_shutdown(self)
+
     def on_prefers_color_scheme(self, *args):
         prefers_color_scheme = self.granite_settings.get_prefers_color_scheme()
         self.gtk_settings.set_property("gtk-application-prefer-dark-theme", prefers_color_scheme)
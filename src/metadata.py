@@ -0,0 +1,245 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import json
+import os
+from collections import deque
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import Gst, GstPbutils, GLib
+
+from .startup import init_gst
+from .utils import TaskExecutor
+
+def analyze_loudness(uri, timeout=60):
+    ''' Returns the clip loudness as {"gain": dB to the reference level, "peak": linear sample peak}, or None on error '''
+    init_gst()
+    pipeline = Gst.parse_launch("uridecodebin name=source ! audioconvert ! audioresample ! rganalysis ! fakesink sync=false")
+    pipeline.get_by_name("source").props.uri = uri
+    bus = pipeline.get_bus()
+
+    loudness = {}
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        while True:
+            message = bus.timed_pop_filtered(timeout * Gst.SECOND, Gst.MessageType.TAG | Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if message is None or message.type == Gst.MessageType.ERROR:
+                return None
+            if message.type == Gst.MessageType.EOS:
+                break
+            tags = message.parse_tag()
+            for name, tag in (("gain", Gst.TAG_TRACK_GAIN), ("peak", Gst.TAG_TRACK_PEAK)):
+                found, value = tags.get_double(tag)
+                if found:
+                    loudness[name] = value
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return loudness if len(loudness) == 2 else None
+
+
+class MetadataService():
+    ''' Looks up clip duration, codec, channels and sample rate in the background.
+
+    Clips are probed with GstPbutils.Discoverer, at most max_jobs at a time,
+    each job on its own discoverer. Results are cached on disk keyed by path,
+    size and mtime, so unchanged files are never probed again.
+
+    Clip loudness is analyzed once on the TaskExecutor and cached alongside,
+    also at most max_jobs at a time as every analysis decodes the whole file.
+
+    Cached results are available right away, probing only begins once
+    start() is called so GStreamer isn't initialized before it's needed.
+    '''
+
+    SAVE_DELAY = 2
+
+    default = None
+
+    def __init__(self, path=None, max_jobs=4, timeout=5, *args, **kwargs):
+
+        self.path = path or os.path.join(GLib.get_user_cache_dir(), "soundjam", "metadata.json")
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.entries = None
+        self.queue = deque()
+        self.callbacks = {}
+        self.loudness_queue = deque()
+        self.loudness_jobs = 0
+        self.loudness_callbacks = {}
+        self.idle_discoverers = []
+        self.discoverers = 0
+        self.started = False
+        self.save_timeout_id = 0
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                self.entries = json.loads(file.read())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        GLib.file_set_contents(self.path, json.dumps(self.entries, separators=(",", ":")).encode("utf-8"))
+
+    def schedule_save(self):
+        if self.save_timeout_id == 0:
+            self.save_timeout_id = GLib.timeout_add_seconds(self.SAVE_DELAY, self.on_save_timeout)
+
+    def flush(self):
+        if self.save_timeout_id > 0:
+            GLib.Source.remove(self.save_timeout_id)
+            self.on_save_timeout()
+
+    def on_save_timeout(self):
+        self.save_timeout_id = 0
+        self.save()
+        return False
+
+    def get_key(self, uri):
+        try:
+            path, hostname = GLib.filename_from_uri(uri)
+            stat = os.stat(path)
+        except (GLib.Error, OSError):
+            return None, None
+        return path, [stat.st_size, stat.st_mtime_ns]
+
+    def get_entry(self, uri, create=False):
+        ''' Returns the cache entry for uri if the file hasn't changed, a fresh one with create '''
+        if self.entries is None:
+            self.load()
+        path, key = self.get_key(uri)
+        if path is None:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry["key"] == key:
+            return entry
+        if create:
+            entry = self.entries[path] = {"key": key}
+            return entry
+        return None
+
+    def lookup(self, uri):
+        ''' Returns the cached metadata for uri if the file hasn't changed, without probing '''
+        entry = self.get_entry(uri)
+        return entry.get("metadata") if entry is not None else None
+
+    def lookup_loudness(self, uri):
+        entry = self.get_entry(uri)
+        return entry.get("loudness") if entry is not None else None
+
+    def request_loudness(self, uri, callback):
+        ''' Calls callback(loudness) with the result of analyze_loudness, analyzing the clip first if needed '''
+        loudness = self.lookup_loudness(uri)
+        if loudness is not None:
+            callback(loudness)
+            return
+        if uri in self.loudness_callbacks:
+            self.loudness_callbacks[uri].append(callback)
+            return
+        self.loudness_callbacks[uri] = [callback]
+        self.loudness_queue.append(uri)
+        self.pump()
+
+    def request(self, uri, callback):
+        ''' Calls callback(metadata) with the clip metadata, probing it first if needed '''
+        metadata = self.lookup(uri)
+        if metadata is not None:
+            callback(metadata)
+            return
+        if uri in self.callbacks:
+            self.callbacks[uri].append(callback)
+            return
+        self.callbacks[uri] = [callback]
+        self.queue.append(uri)
+        self.pump()
+
+    def forget(self, uris):
+        ''' Drops the queued requests and callbacks for uris, cached entries are kept '''
+        uris = set(uris)
+        self.queue = deque(uri for uri in self.queue if uri not in uris)
+        self.loudness_queue = deque(uri for uri in self.loudness_queue if uri not in uris)
+        for uri in uris:
+            self.callbacks.pop(uri, None)
+            self.loudness_callbacks.pop(uri, None)
+
+    def start(self):
+        init_gst()
+        self.started = True
+        self.pump()
+
+    def pump(self):
+        if not self.started:
+            return
+        while self.loudness_queue and self.loudness_jobs < self.max_jobs:
+            uri = self.loudness_queue.popleft()
+            self.loudness_jobs += 1
+            TaskExecutor.get_default().submit(analyze_loudness, uri, callback=lambda future, uri=uri: self.on_loudness_analyzed(uri, future))
+        while self.queue:
+            discoverer = self.get_discoverer()
+            if discoverer is None:
+                return
+            discoverer.discover_uri_async(self.queue.popleft())
+
+    def get_discoverer(self):
+        if self.idle_discoverers:
+            return self.idle_discoverers.pop()
+        if self.discoverers >= self.max_jobs:
+            return None
+        discoverer = GstPbutils.Discoverer.new(self.timeout * Gst.SECOND)
+        discoverer.connect("discovered", self.on_discovered)
+        discoverer.start()
+        self.discoverers += 1
+        return discoverer
+
+    def on_discovered(self, discoverer, info, error):
+        uri = info.get_uri()
+        metadata = self.parse(info)
+
+        if metadata is not None:
+            entry = self.get_entry(uri, create=True)
+            if entry is not None:
+                entry["metadata"] = metadata
+                self.schedule_save()
+
+        for callback in self.callbacks.pop(uri, []):
+            callback(metadata)
+
+        self.idle_discoverers.append(discoverer)
+        self.pump()
+
+    def on_loudness_analyzed(self, uri, future):
+        self.loudness_jobs -= 1
+        self.pump()
+        loudness = future.result() if future.exception() is None else None
+        if loudness is not None:
+            entry = self.get_entry(uri, create=True)
+            if entry is not None:
+                entry["loudness"] = loudness
+                self.schedule_save()
+        for callback in self.loudness_callbacks.pop(uri, []):
+            callback(loudness)
+
+    def parse(self, info):
+        if info.get_result() != GstPbutils.DiscovererResult.OK:
+            return None
+        streams = info.get_audio_streams()
+        if not streams:
+            return None
+        stream = streams[0]
+        caps = stream.get_caps()
+        return {
+            "duration": info.get_duration(),
+            "codec": GstPbutils.pb_utils_get_codec_description(caps) if caps is not None else None,
+            "channels": stream.get_channels(),
+            "rate": stream.get_sample_rate(),
+            "bitrate": stream.get_bitrate(),
+        }
@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from .samplecache import Sample
+from .startup import init_gst
+from .instrumentation import Instrumentation
+from .dispatcher import BusDispatcher
+
+class Mixer():
+    ''' One long-lived pipeline mixing every playing clip into a single audio sink.
+
+    A silent live source keeps the mixer running with no clips attached, so
+    the sink is opened once and clips only add or remove mixer inputs.
+
+    A new input is scheduled ahead of the mixer's running time. The live mixer
+    drops samples that arrive behind its output position, so this leaves the
+    branch time to preroll without losing its attack: START_MARGIN for a
+    file to decode, CACHED_START_MARGIN for a cached sample pushed right away.
+    '''
+
+    START_MARGIN = 100 * Gst.MSECOND
+    CACHED_START_MARGIN = 20 * Gst.MSECOND
+
+    default = None
+    live = 0
+
+    def __init__(self, audio_sink=None, *args, **kwargs):
+
+        init_gst()
+
+        self.pipeline = Gst.parse_launch("audiotestsrc wave=silence is-live=true ! audiomixer name=mixer ! capsfilter name=caps ! audioconvert ! audioresample name=resample")
+        if audio_sink is None:
+            audio_sink = Gst.ElementFactory.make("autoaudiosink", None)
+        self.pipeline.add(audio_sink)
+        self.pipeline.get_by_name("resample").link(audio_sink)
+        self.mixer = self.pipeline.get_by_name("mixer")
+        self.pipeline.get_by_name("caps").props.caps = Gst.Caps.from_string(Sample.CAPS)
+        self.branches = {}
+        self.running = False
+        self.closed = False
+
+        self.bus = self.pipeline.get_bus()
+        BusDispatcher.get_default().add(self.bus, Gst.MessageType.ERROR | Gst.MessageType.WARNING | Gst.MessageType.QOS, self.on_message)
+        Mixer.live += 1
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    def get_running_time(self):
+        clock = self.pipeline.get_clock()
+        if clock is None:
+            return 0
+        return clock.get_time() - self.pipeline.get_base_time()
+
+    def attach(self, voice, branch):
+        if not self.running:
+            self.pipeline.set_state(Gst.State.PLAYING)
+            self.running = True
+
+        self.pipeline.add(branch)
+        srcpad = branch.get_static_pad("src")
+        sinkpad = self.mixer.get_request_pad("sink_%u")
+        sinkpad.props.volume = voice.owner.volume
+        margin = self.CACHED_START_MARGIN if voice.sample is not None else self.START_MARGIN
+        voice.offset = self.get_running_time() + margin
+        srcpad.set_offset(voice.offset)
+        srcpad.link(sinkpad)
+        self.branches[branch.get_name()] = voice
+        branch.sync_state_with_parent()
+        return sinkpad
+
+    def detach(self, branch, sinkpad):
+        branch.set_state(Gst.State.NULL)
+        branch.get_static_pad("src").unlink(sinkpad)
+        self.pipeline.remove(branch)
+        self.mixer.release_request_pad(sinkpad)
+        self.branches.pop(branch.get_name(), None)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        self.running = False
+
+    def close(self):
+        ''' Tears the pipeline down for good, closing the sink and its bus route '''
+        if self.closed:
+            return
+        self.closed = True
+        self.stop()
+        BusDispatcher.get_default().remove(self.bus)
+        Mixer.live -= 1
+        if Mixer.default is self:
+            Mixer.default = None
+
+    def on_message(self, bus, message):
+        Instrumentation.get_default().message(None, message.type)
+        if message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print("Error: %s" % err, debug)
+            element = message.src
+            while element is not None and element.get_name() not in self.branches:
+                element = element.get_parent()
+            if element is None:
+                self.stop()
+            else:
+                voice = self.branches[element.get_name()]
+                voice.pool.unbind(voice, notify=True)
+
+
+class MixerVoice():
+    ''' A voice playing as a branch of the shared Mixer instead of its own pipeline '''
+
+    live = 0
+
+    def __init__(self, pool, index, *args, **kwargs):
+
+        self.pool = pool
+        self.index = index
+        self.owner = None
+        self.playing = False
+        self.priority = 0
+        self.started = 0
+        self.last_used = 0
+        self.sample = None
+        self.branch = None
+        self.sinkpad = None
+        self.offset = 0
+        self.closed = False
+        self.mixer = pool.get_mixer()
+        MixerVoice.live += 1
+
+    @property
+    def active(self):
+        return self.playing
+
+    @property
+    def parked(self):
+        return False
+
+    def start(self, owner, priority=0, sample=None):
+        self.detach()
+        self.owner = owner
+        self.sample = sample
+        self.branch = self.generate_branch(owner.uri, sample)
+        self.resume(priority)
+
+    def resume(self, priority=0):
+        self.playing = True
+        self.priority = priority
+        self.started = self.last_used = GLib.get_monotonic_time()
+        Instrumentation.get_default().trigger(self, self.owner.uri, "attach")
+        self.branch.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_first_buffer)
+        self.sinkpad = self.mixer.attach(self, self.branch)
+        Instrumentation.get_default().state_reached(self)
+
+    def park(self):
+        # mixer inputs are detached once done, there is nothing to keep warm
+        self.stop()
+
+    def close(self):
+        # the branch goes with stop, the mixer pipeline is shared
+        self.stop()
+        if not self.closed:
+            self.closed = True
+            MixerVoice.live -= 1
+
+    def set_volume(self, volume):
+        if self.sinkpad is not None:
+            self.sinkpad.props.volume = volume
+
+    def stop(self):
+        self.detach()
+        self.owner = None
+        self.playing = False
+        self.priority = 0
+        self.sample = None
+
+    def detach(self):
+        if self.branch is not None and self.sinkpad is not None:
+            self.mixer.detach(self.branch, self.sinkpad)
+        self.branch = None
+        self.sinkpad = None
+
+    def query_progress(self):
+        ''' Returns (position, duration) in ns, -1 where unknown '''
+        if self.branch is None:
+            return -1, -1
+        position = self.mixer.get_running_time() - self.offset
+        if position < 0:
+            # scheduled, not audible yet
+            return -1, -1
+        if self.sample is not None:
+            return position, self.sample.duration
+        ok, duration = self.branch.query_duration(Gst.Format.TIME)
+        return position, duration if ok else -1
+
+    def generate_branch(self, uri, sample):
+        branch = Gst.Bin.new("voice-{0}".format(self.index))
+
+        if sample is not None:
+            source = Gst.ElementFactory.make("appsrc", None)
+            source.props.caps = sample.caps
+            source.props.format = Gst.Format.TIME
+            source.connect("need-data", self.on_need_data, sample)
+            branch.add(source)
+            srcpad = source.get_static_pad("src")
+        else:
+            source = Gst.ElementFactory.make("uridecodebin", None)
+            source.props.uri = uri
+            convert = Gst.ElementFactory.make("audioconvert", None)
+            resample = Gst.ElementFactory.make("audioresample", None)
+            capsfilter = Gst.ElementFactory.make("capsfilter", None)
+            capsfilter.props.caps = Gst.Caps.from_string(Sample.CAPS)
+            for element in [source, convert, resample, capsfilter]:
+                branch.add(element)
+            convert.link(resample)
+            resample.link(capsfilter)
+            source.connect("pad-added", self.on_pad_added, convert)
+            srcpad = capsfilter.get_static_pad("src")
+
+        ghostpad = Gst.GhostPad.new("src", srcpad)
+        ghostpad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_event_probe, branch)
+        branch.add_pad(ghostpad)
+        return branch
+
+    def on_first_buffer(self, pad, info):
+        Instrumentation.get_default().first_buffer(self)
+        return Gst.PadProbeReturn.REMOVE
+
+    def on_need_data(self, source, length, sample):
+        source.emit("push-buffer", sample.buffer)
+        source.emit("end-of-stream")
+
+    def on_pad_added(self, source, pad, convert):
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        sinkpad = convert.get_static_pad("sink")
+        if caps.get_structure(0).get_name().startswith("audio/") and not sinkpad.is_linked():
+            pad.link(sinkpad)
+
+    def on_event_probe(self, pad, info, branch):
+        # drop the EOS and detach the branch rather than leave a finished input on the mixer
+        if info.get_event().type == Gst.EventType.EOS:
+            GLib.idle_add(self.on_eos, branch)
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def on_eos(self, branch):
+        if branch is self.branch and self.playing:
+            self.pool.finish(self, notify=True)
+        return False
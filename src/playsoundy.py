@@ -3,58 +3,498 @@
 
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+from gi.repository import Gst, GLib
 
-class Playsoundy():
-    Gst.init(None)
+from .samplecache import SampleCache
+from .mixer import Mixer, MixerVoice
+from .startup import init_gst
+from .transport import TransportController
+from .instrumentation import Instrumentation
+from .dispatcher import BusDispatcher
 
-    def __init__(self, soundclip, *args, **kwargs):
-        # super().__init__(*args, **kwargs)
+class Voice():
+    ''' A reusable playback pipeline borrowed from a VoicePool by a Playsoundy.
 
-        self.soundclip = soundclip
+    A voice stays bound to its owner after playback when the pool keeps it
+    warm, parked in PAUSED at position 0 so retriggering is only a state change.
 
-        self.player = Gst.ElementFactory.make("playbin", "player")
-        fakesink = Gst.ElementFactory.make("fakesink", "fakesink")
-        self.player.set_property("video-sink", fakesink)
+    Looping owners are played in segment mode: the end of the loop region
+    posts SEGMENT_DONE instead of EOS and a non-flushing segment seek back to
+    its start keeps the stream going without a gap or a new preroll.
+    '''
 
-        self.player.props.uri = self.soundclip .uri
+    # pipelines created and not closed yet, to spot leaks over long sessions
+    live = 0
 
-        
-        # self.player.set_state(Gst.State.PLAYING)
+    # what the voice, its transport and the instrumentation look at, everything else is dropped unseen
+    MESSAGE_TYPES = (Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.WARNING | Gst.MessageType.QOS
+                     | Gst.MessageType.STATE_CHANGED | Gst.MessageType.ASYNC_DONE | Gst.MessageType.SEGMENT_DONE
+                     | Gst.MessageType.DURATION_CHANGED)
 
-        self.bus = self.player.get_bus()
+    def __init__(self, pool, index, *args, **kwargs):
 
+        init_gst()
 
-        self.bus.add_signal_watch()
-        self.bus.connect("message", self.on_message)
+        self.pool = pool
+        self.index = index
+        self.owner = None
+        self.playing = False
+        self.priority = 0
+        self.started = 0
+        self.last_used = 0
+        self.sample = None
+        self.loop_pending = False
+        self.closed = False
 
-        # self.player.set_state(Gst.State.NULL)
+        self.player = Gst.ElementFactory.make("playbin", "voice-{0}".format(index))
+        fakesink = Gst.ElementFactory.make("fakesink", "fakesink-{0}".format(index))
+        self.player.set_property("video-sink", fakesink)
+        # the sink is set explicitly, as playbin would pick it, so first buffers can be timed on its pad
+        audio_sink = pool.audio_sink() if pool.audio_sink is not None else Gst.ElementFactory.make("autoaudiosink", "audio-sink-{0}".format(index))
+        self.player.set_property("audio-sink", audio_sink)
+        self.sinkpad = audio_sink.get_static_pad("sink")
+        self.buffer_probe_id = 0
+        self.player.connect("source-setup", self.on_source_setup)
+        self.transport = TransportController(self.player)
 
-    def play_pause(self):
-        if self.soundclip.play_revealer.props.name == "soundclip-play":
-            self.soundclip.play_revealer.set_reveal_child(False)
-            self.soundclip.play_revealer.props.name = "soundclip-pause"
-            self.player.set_state(Gst.State.NULL)
+        self.bus = self.player.get_bus()
+        BusDispatcher.get_default().add(self.bus, self.MESSAGE_TYPES, self.on_message)
+        Voice.live += 1
+
+    @property
+    def active(self):
+        return self.playing
+
+    @property
+    def parked(self):
+        return self.owner is not None and not self.playing
+
+    def start(self, owner, priority=0, sample=None):
+        self.player.set_state(Gst.State.NULL)
+        self.owner = owner
+        self.sample = sample
+        if sample is not None:
+            self.player.props.uri = "appsrc://"
         else:
-            self.soundclip.play_revealer.set_reveal_child(True)
-            self.soundclip.play_revealer.props.name = "soundclip-play"
+            self.player.props.uri = owner.uri
+        self.player.props.volume = owner.volume
+        self.transport.invalidate()
+        # the segment seek needs a prerolled pipeline, on_message seeks and starts playing once it is
+        self.loop_pending = owner.loop
+        if self.loop_pending:
+            self.player.set_state(Gst.State.PAUSED)
+        self.resume(priority)
+
+    def prepare(self, owner, sample=None):
+        ''' Binds the voice to owner and prerolls it in PAUSED without playing '''
+        self.player.set_state(Gst.State.NULL)
+        self.owner = owner
+        self.sample = sample
+        self.playing = False
+        self.priority = 0
+        self.last_used = GLib.get_monotonic_time()
+        self.player.props.uri = "appsrc://" if sample is not None else owner.uri
+        self.player.props.volume = owner.volume
+        self.transport.invalidate()
+        self.loop_pending = owner.loop
+        self.player.set_state(Gst.State.PAUSED)
+
+    def resume(self, priority=0):
+        self.playing = True
+        self.priority = priority
+        self.started = self.last_used = GLib.get_monotonic_time()
+        ret, state, pending = self.player.get_state(0)
+        transition = "PAUSED->PLAYING" if state == Gst.State.PAUSED else "NULL->PLAYING"
+        Instrumentation.get_default().trigger(self, self.owner.uri, transition)
+        if self.buffer_probe_id == 0:
+            self.buffer_probe_id = self.sinkpad.add_probe(Gst.PadProbeType.BUFFER, self.on_first_buffer)
+        if not self.loop_pending:
             self.player.set_state(Gst.State.PLAYING)
 
+    def on_first_buffer(self, pad, info):
+        self.buffer_probe_id = 0
+        Instrumentation.get_default().first_buffer(self)
+        return Gst.PadProbeReturn.REMOVE
+
+    def park(self):
+        self.playing = False
+        self.priority = 0
+        self.last_used = GLib.get_monotonic_time()
+        self.player.set_state(Gst.State.PAUSED)
+        if self.owner.loop:
+            self.seek_loop(flush=True)
+        else:
+            self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 0)
+
+    def seek_loop(self, flush=True):
+        ''' Seeks to the owner's loop region in segment mode, -1 as loop_out plays to the end '''
+        flags = Gst.SeekFlags.SEGMENT | Gst.SeekFlags.ACCURATE
+        if flush:
+            flags |= Gst.SeekFlags.FLUSH
+        self.transport.invalidate()
+        self.player.seek(1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, self.owner.loop_in, Gst.SeekType.SET, self.owner.loop_out)
+
+    def set_volume(self, volume):
+        self.player.props.volume = volume
+
+    def stop(self):
+        self.player.set_state(Gst.State.NULL)
+        self.owner = None
+        self.playing = False
+        self.priority = 0
+        self.sample = None
+        self.loop_pending = False
+        Instrumentation.get_default().cancel(self)
+
+    def close(self):
+        ''' Tears the pipeline down for good and stops routing its bus '''
+        if self.closed:
+            return
+        self.closed = True
+        self.stop()
+        if self.buffer_probe_id > 0:
+            self.sinkpad.remove_probe(self.buffer_probe_id)
+            self.buffer_probe_id = 0
+        BusDispatcher.get_default().remove(self.bus)
+        Voice.live -= 1
+
+    def query_progress(self):
+        ''' Returns (position, duration) in ns, -1 where unknown '''
+        position = self.transport.get_position()
+        if position < 0:
+            return -1, -1
+        return position, self.transport.get_duration()
+
+    def on_source_setup(self, player, source):
+        if self.sample is None or source.get_factory().get_name() != "appsrc":
+            return
+        source.props.caps = self.sample.caps
+        source.props.format = Gst.Format.TIME
+        Gst.util_set_object_arg(source, "stream-type", "seekable")
+        source.connect("need-data", self.on_need_data, self.sample)
+        source.connect("seek-data", self.on_seek_data)
+
+    def on_need_data(self, source, length, sample):
+        # the whole clip is one buffer, so every request after a flush restarts it from 0
+        source.emit("push-buffer", sample.buffer)
+        source.emit("end-of-stream")
+
+    def on_seek_data(self, source, offset):
+        return True
+
     def on_message(self, bus, message):
-        # print(message.type)
+        # every element of the playbin posts its state changes, only the pipeline's matter
+        if message.type == Gst.MessageType.STATE_CHANGED and message.src != self.player:
+            return
+        self.transport.handle_message(message)
+        Instrumentation.get_default().message(self.owner.uri if self.owner is not None else None, message.type)
+        if self.owner is None:
+            return
+        if message.type == Gst.MessageType.STATE_CHANGED:
+            if message.parse_state_changed()[1] == Gst.State.PLAYING:
+                Instrumentation.get_default().state_reached(self)
+            return
         if message.type == Gst.MessageType.EOS:
-            self.player.set_state(Gst.State.NULL)
-            self.soundclip.play_revealer.set_reveal_child(False)
-            self.soundclip.play_revealer.props.name == "soundclip-play"
+            if self.playing:
+                self.pool.finish(self, notify=True)
+        elif message.type == Gst.MessageType.ASYNC_DONE:
+            if self.loop_pending:
+                self.loop_pending = False
+                self.seek_loop(flush=True)
+                if self.playing:
+                    self.player.set_state(Gst.State.PLAYING)
+        elif message.type == Gst.MessageType.SEGMENT_DONE:
+            if self.playing and self.owner.loop:
+                self.seek_loop(flush=False)
+            elif self.playing:
+                self.pool.finish(self, notify=True)
         elif message.type == Gst.MessageType.ERROR:
-            self.soundclip.play_revealer.set_reveal_child(False)
-            self.soundclip.play_revealer.props.name = "soundclip-play"
-            self.player.set_state(Gst.State.NULL)
             err, debug = message.parse_error()
             print("Error: %s" % err, debug)
-            # self.button.set_label("Start")
-        # elif message.type == Gst.MessageType.ASYNC_DONE:
-        #     print(self.player.query_duration(Gst.Format.TIME)[1] / 1000000000)
+            self.pool.unbind(self, notify=True)
+
+
+class VoicePool():
+    ''' Fixed-size set of playback voices shared by every clip on the board.
+
+    Voices are created on first use up to the polyphony limit. The policy
+    decides what happens to a voice once its clip stops:
+
+    stop: the pipeline is torn down to NULL and the voice is free again
+    park: the voice is parked in PAUSED at 0 and stays bound to its clip
+    warm: like park, but only the warm_clips most recently used stay parked
+
+    When no voice is free the least recently used parked voice is reused,
+    then the oldest playing voice with the lowest priority is stolen.
+
+    With the mixer engine every voice is an input of one shared pipeline
+    instead, and voices are always released once their clip stops.
+
+    audio_sink is an optional callable returning the sink element to use in
+    place of the default audio output, e.g. a fakesink for benchmarks.
+    '''
+
+    POLICY_STOP = "stop"
+    POLICY_PARK = "park"
+    POLICY_WARM = "warm"
+
+    ENGINE_VOICES = "voices"
+    ENGINE_MIXER = "mixer"
+
+    default = None
+
+    def __init__(self, polyphony=16, policy=POLICY_STOP, warm_clips=4, engine=ENGINE_VOICES, audio_sink=None, *args, **kwargs):
+
+        self.polyphony = max(1, polyphony)
+        self.policy = policy
+        self.warm_clips = warm_clips
+        self.engine = engine
+        self.audio_sink = audio_sink
+        self.mixer = None
+        self.voices = []
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+            Instrumentation.get_default().add_gauge("active_voices", lambda: len(cls.default.get_active_voices()))
+            Instrumentation.get_default().add_gauge("voices", lambda: len(cls.default.voices))
+            Instrumentation.get_default().add_gauge("live_voices", lambda: Voice.live + MixerVoice.live)
+            Instrumentation.get_default().add_gauge("live_pipelines", lambda: Voice.live + Mixer.live)
+            Instrumentation.get_default().add_gauge("bus_routes", lambda: len(BusDispatcher.get_default().routes))
+        return cls.default
+
+    def set_polyphony(self, polyphony):
+        self.polyphony = max(1, polyphony)
+        for voice in self.voices[self.polyphony:]:
+            self.unbind(voice, notify=True)
+            voice.close()
+        del self.voices[self.polyphony:]
+
+    def set_policy(self, policy, warm_clips=None):
+        self.policy = policy
+        if warm_clips is not None:
+            self.warm_clips = max(0, warm_clips)
+        if self.policy == self.POLICY_STOP:
+            for voice in self.get_parked_voices():
+                self.unbind(voice)
+        self.trim()
+
+    def set_engine(self, engine):
+        if engine == self.engine:
+            return
+        for voice in self.voices:
+            self.unbind(voice, notify=True)
+            voice.close()
+        self.voices = []
+        self.close_mixer()
+        self.engine = engine
+
+    def close(self):
+        ''' Stops and tears down every voice and the mixer, for shutdown '''
+        for voice in self.voices:
+            self.unbind(voice)
+            voice.close()
+        self.voices = []
+        self.close_mixer()
+
+    def close_mixer(self):
+        if self.mixer is not None:
+            self.mixer.close()
+            self.mixer = None
+
+    def get_mixer(self):
+        if self.mixer is None:
+            if self.audio_sink is None:
+                self.mixer = Mixer.get_default()
+            else:
+                self.mixer = Mixer(audio_sink=self.audio_sink())
+        return self.mixer
+
+    def create_voice(self, index):
+        if self.engine == self.ENGINE_MIXER:
+            return MixerVoice(self, index)
+        return Voice(self, index)
+
+    def get_active_voices(self):
+        return [voice for voice in self.voices if voice.active]
+
+    def get_parked_voices(self):
+        return sorted((voice for voice in self.voices if voice.parked), key=lambda voice: voice.last_used)
+
+    def acquire(self, owner, priority=0, sample=None):
+        voice = owner.voice
+        if voice is not None and voice.owner is owner:
+            voice.resume(priority)
+            return voice
+
+        voice = next((voice for voice in self.voices if voice.owner is None), None)
+
+        if voice is None and len(self.voices) < self.polyphony:
+            voice = self.create_voice(len(self.voices))
+            self.voices.append(voice)
+
+        if voice is None:
+            parked = self.get_parked_voices()
+            if parked:
+                voice = parked[0]
+            else:
+                voice = min(self.voices, key=lambda voice: (voice.priority, voice.started))
+            self.unbind(voice, notify=True)
+
+        voice.start(owner, priority, sample)
+        owner.voice = voice
+        return voice
+
+    def preload(self, owner, sample=None):
+        ''' Prerolls a voice for owner so its first trigger is only a state change.
+
+        Only free voices, or new ones under the polyphony limit, are used, so
+        preloading never takes a voice from another clip. Nothing is kept
+        when voices are released after playback or with the mixer engine.
+        '''
+        if self.policy == self.POLICY_STOP or self.engine == self.ENGINE_MIXER or owner.voice is not None:
+            return None
+
+        voice = next((voice for voice in self.voices if voice.owner is None), None)
+        if voice is None and len(self.voices) < self.polyphony:
+            voice = self.create_voice(len(self.voices))
+            self.voices.append(voice)
+        if voice is None:
+            return None
+
+        voice.prepare(owner, sample)
+        owner.voice = voice
+        self.trim()
+        return owner.voice
+
+    def release(self, owners):
+        ''' Frees the parked voices bound to any of owners '''
+        owners = set(owners)
+        for voice in self.get_parked_voices():
+            if voice.owner in owners:
+                self.unbind(voice)
+
+    def remove(self, owners):
+        ''' Frees every voice bound to any of owners, playing ones included, for clips leaving the board '''
+        owners = set(owners)
+        for voice in self.voices:
+            if voice.owner in owners:
+                self.unbind(voice)
+
+    def finish(self, voice, notify=False):
+        if self.policy == self.POLICY_STOP or self.engine == self.ENGINE_MIXER:
+            self.unbind(voice, notify)
+            return
+        voice.park()
+        self.trim()
+        if notify:
+            voice.owner.on_finished()
+
+    def trim(self):
+        if self.policy != self.POLICY_WARM:
+            return
+        parked = self.get_parked_voices()
+        for voice in parked[:max(0, len(parked) - self.warm_clips)]:
+            self.unbind(voice)
+
+    def unbind(self, voice, notify=False):
+        owner = voice.owner
+        playing = voice.playing
+        voice.stop()
+        if owner is not None:
+            owner.voice = None
+            if notify and playing:
+                owner.on_finished()
+
+
+class Playsoundy():
+    ''' Per-clip playback controller, borrows a Voice only while playing or kept warm '''
+
+    def __init__(self, soundclip, priority=0, pool=None, cache=None, *args, **kwargs):
+
+        self.soundclip = soundclip
+        self.priority = priority
+        self.pool = pool
+        self.cache = cache
+        self.voice = None
+        self.volume = 1.0
+        self.loop = False
+        self.loop_in = 0
+        self.loop_out = -1
+
+    @property
+    def uri(self):
+        return self.soundclip.uri
+
+    @property
+    def playing(self):
+        return self.voice is not None and self.voice.playing
+
+    def set_volume(self, volume):
+        ''' Sets the linear gain the clip plays at, applied right away if a voice is bound '''
+        self.volume = volume
+        if self.voice is not None:
+            self.voice.set_volume(volume)
+
+    def set_loop(self, loop, loop_in=0, loop_out=-1):
+        ''' Loops the clip from loop_in to loop_out in ns, -1 being the end.
+
+        Loops are gapless with the voices engine, the mixer engine plays them once.
+        A playing clip picks the change up when it reaches the end of its region.
+        '''
+        self.loop = loop
+        self.loop_in = max(0, loop_in)
+        self.loop_out = loop_out if loop_out > self.loop_in else -1
+        if self.voice is not None and self.voice.parked:
+            # a warm voice was prerolled for the previous mode
+            self.pool.unbind(self.voice)
+
+    def play_pause(self):
+        if self.playing:
+            self.stop()
+        else:
+            self.play()
+
+    def play(self):
+        if self.pool is None:
+            self.pool = VoicePool.get_default()
+        if self.cache is None:
+            self.cache = SampleCache.get_default()
+        sample = None
+        # loops are seeked in segment mode, which only the file source supports
+        if self.voice is None and not self.loop:
+            sample = self.cache.lookup(self.uri)
+            if sample is None:
+                self.cache.request(self.uri)
+        self.pool.acquire(self, self.priority, sample)
+        self.soundclip.set_playing(True)
+
+    def preload(self, voice=True):
+        ''' Decodes the clip into the sample cache in the background and, if voice is set, prerolls a voice for it '''
+        if self.pool is None:
+            self.pool = VoicePool.get_default()
+        if self.cache is None:
+            self.cache = SampleCache.get_default()
+        sample = self.cache.peek(self.uri)
+        if sample is None:
+            self.cache.request(self.uri)
+        if voice:
+            self.pool.preload(self, None if self.loop else sample)
+
+    def stop(self):
+        if self.playing:
+            self.pool.finish(self.voice)
+        self.soundclip.set_playing(False)
+
+    def on_finished(self):
+        self.soundclip.set_playing(False)
+
+    def close(self):
+        ''' Gives the voice back for good and drops the reference to the clip, breaking their cycle '''
+        if self.voice is not None:
+            self.pool.unbind(self.voice)
+        self.soundclip = None
 
 def play(uri):
     import gi
@@ -66,7 +506,7 @@ def play(uri):
     player = Gst.ElementFactory.make("playbin", "player")
     fakesink = Gst.ElementFactory.make("fakesink", "fakesink")
     player.set_property("video-sink", fakesink)
-    
+
     player.props.uri = uri
 
     player.set_state(Gst.State.PLAYING)
@@ -78,8 +518,3 @@ def play(uri):
     bus.poll(Gst.MessageType.EOS, Gst.CLOCK_TIME_NONE)
 
     player.set_state(Gst.State.NULL)
-
-
-
-
-
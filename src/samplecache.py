@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+from collections import OrderedDict
+from threading import Lock
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from .startup import init_gst
+from .utils import TaskExecutor
+from .instrumentation import Instrumentation
+
+class Sample():
+    ''' A clip decoded once into a single raw PCM buffer '''
+
+    RATE = 48000
+    CHANNELS = 2
+    WIDTH = 2
+    CAPS = "audio/x-raw,format=S16LE,layout=interleaved,rate={0},channels={1}".format(RATE, CHANNELS)
+
+    def __init__(self, uri, data, *args, **kwargs):
+
+        self.uri = uri
+        self.nbytes = len(data)
+        self.duration = Gst.util_uint64_scale(self.nbytes // (self.CHANNELS * self.WIDTH), Gst.SECOND, self.RATE)
+        self.caps = Gst.Caps.from_string(self.CAPS)
+
+        # the same buffer is pushed on every trigger, downstream only ever gets a new ref
+        self.buffer = Gst.Buffer.new_wrapped(data)
+        self.buffer.pts = 0
+        self.buffer.duration = self.duration
+
+    @classmethod
+    def bytes_per_second(cls):
+        return cls.RATE * cls.CHANNELS * cls.WIDTH
+
+
+class DecodeError(Exception):
+    pass
+
+
+def decode_stream(uri, caps=Sample.CAPS):
+    ''' Decodes uri to interleaved PCM in caps, yielding (data, duration) for every buffer.
+
+    duration is the stream duration in ns, -1 if unknown. Raises DecodeError
+    if decoding fails, closing the generator early stops the pipeline.
+    '''
+    init_gst()
+    pipeline = Gst.parse_launch("uridecodebin name=source ! audioconvert ! audioresample ! appsink name=sink sync=false")
+    pipeline.get_by_name("source").props.uri = uri
+    sink = pipeline.get_by_name("sink")
+    sink.props.caps = Gst.Caps.from_string(caps)
+
+    duration = None
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        while True:
+            sample = sink.emit("pull-sample")
+            if sample is None:
+                break
+            if duration is None:
+                ok, duration = pipeline.query_duration(Gst.Format.TIME)
+                if not ok:
+                    duration = -1
+            buffer = sample.get_buffer()
+            yield buffer.extract_dup(0, buffer.get_size()), duration
+        message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+        if message is not None:
+            err, debug = message.parse_error()
+            print("Error: %s" % err, debug)
+            raise DecodeError(err.message)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def decode(uri, max_bytes=None, caps=Sample.CAPS):
+    ''' Decode uri to interleaved PCM in caps, returns bytes or None on error or if max_bytes is exceeded '''
+    chunks = []
+    nbytes = 0
+    stream = decode_stream(uri, caps)
+    try:
+        for data, duration in stream:
+            nbytes += len(data)
+            if max_bytes is not None and nbytes > max_bytes:
+                return None
+            chunks.append(data)
+    except DecodeError:
+        return None
+    finally:
+        stream.close()
+    return b"".join(chunks)
+
+
+class SampleCache():
+    ''' LRU cache of decoded samples bounded by a byte budget.
+
+    Misses are decoded in the background so the first trigger plays from the
+    file and the following ones play straight from memory.
+    '''
+
+    default = None
+
+    def __init__(self, budget=64 * 1024 * 1024, max_duration=10, *args, **kwargs):
+
+        self.budget = budget
+        self.max_duration = max_duration
+        self.samples = OrderedDict()
+        self.pending = set()
+        self.rejected = set()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+            Instrumentation.get_default().add_gauge("sample_cache", cls.default.stats)
+        return cls.default
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def lookup(self, uri):
+        with self.lock:
+            sample = self.samples.get(uri)
+            if sample is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.samples.move_to_end(uri)
+            return sample
+
+    def request(self, uri):
+        if self.budget <= 0:
+            return
+        with self.lock:
+            if uri in self.samples or uri in self.pending or uri in self.rejected:
+                return
+            self.pending.add(uri)
+        TaskExecutor.get_default().submit(self.load, uri)
+
+    def load(self, uri):
+        data = decode(uri, max_bytes=min(self.budget, self.max_duration * Sample.bytes_per_second()))
+        with self.lock:
+            if uri not in self.pending:
+                # discarded while decoding
+                return
+            self.pending.discard(uri)
+            if data is None:
+                self.rejected.add(uri)
+            else:
+                self.insert(Sample(uri, data))
+
+    def insert(self, sample):
+        if sample.uri in self.samples:
+            self.nbytes -= self.samples.pop(sample.uri).nbytes
+        self.samples[sample.uri] = sample
+        self.nbytes += sample.nbytes
+        self.evict()
+
+    def evict(self):
+        while self.nbytes > self.budget and self.samples:
+            uri, sample = self.samples.popitem(last=False)
+            self.nbytes -= sample.nbytes
+            self.evictions += 1
+
+    def peek(self, uri):
+        ''' Returns the cached sample for uri without counting a lookup or touching its LRU position '''
+        with self.lock:
+            return self.samples.get(uri)
+
+    def discard(self, uris):
+        ''' Drops the samples for uris, to give their memory back, decodes still running are thrown away '''
+        with self.lock:
+            for uri in uris:
+                self.pending.discard(uri)
+                self.rejected.discard(uri)
+                sample = self.samples.pop(uri, None)
+                if sample is not None:
+                    self.nbytes -= sample.nbytes
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.samples),
+                "bytes": self.nbytes,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
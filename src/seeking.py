@@ -8,6 +8,8 @@ from gi.repository import Gst, GObject, Gtk, Gdk
 
 from threading import Thread
 
+from transport import TransportController
+
 class GTK_Main:
 
     def __init__(self):
@@ -32,6 +34,10 @@ class GTK_Main:
         forward_button = Gtk.Button("Forward")
         forward_button.connect("clicked", self.forward_callback)
         buttonbox.add(forward_button)
+        accurate_button = Gtk.CheckButton("Accurate")
+        accurate_button.props.active = True
+        accurate_button.connect("toggled", self.accurate_callback)
+        buttonbox.add(accurate_button)
         self.time_label = Gtk.Label()
         self.time_label.set_text("00:00 / 00:00")
         hbox.add(self.time_label)
@@ -51,6 +57,8 @@ class GTK_Main:
         self.audio_decoder.link(audioconv)
         audioconv.link(audiosink)
 
+        self.transport = TransportController(self.player)
+
         bus = self.player.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self.on_message)
@@ -79,7 +87,7 @@ class GTK_Main:
         while play_thread_id == self.play_thread_id:
             try:
                 time.sleep(0.2)
-                dur_int = self.player.query_duration(Gst.Format.TIME, None)[0]
+                dur_int = self.transport.get_duration()
                 if dur_int == -1:
                     continue
                 dur_str = self.convert_ns(dur_int)
@@ -92,7 +100,7 @@ class GTK_Main:
 
         time.sleep(0.2)
         while play_thread_id == self.play_thread_id:
-            pos_int = self.player.query_position(Gst.Format.TIME, None)[0]
+            pos_int = self.transport.get_position()
             pos_str = self.convert_ns(pos_int)
             if play_thread_id == self.play_thread_id:
                 Gdk.threads_enter()
@@ -101,6 +109,7 @@ class GTK_Main:
             time.sleep(1)
 
     def on_message(self, bus, message):
+        self.transport.handle_message(message)
         t = message.type
         if t == Gst.MessageType.EOS:
             self.play_thread_id = None
@@ -120,18 +129,16 @@ class GTK_Main:
         pad.link(adec_pad)
 
     def rewind_callback(self, w):
-        rc, pos_int = self.player.query_position(Gst.Format.TIME)
-        seek_ns = pos_int - 10 * 1000000000
-        if seek_ns < 0:
-            seek_ns = 0
-        # print 'Backward: %d ns -> %d ns' % (pos_int, seek_ns)
-        self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, seek_ns)
+        self.transport.seek_relative(-10 * Gst.SECOND)
 
     def forward_callback(self, w):
-        rc, pos_int = self.player.query_position(Gst.Format.TIME)
-        seek_ns = pos_int + 10 * 1000000000
-        # print 'Forward: %d ns -> %d ns' % (pos_int, seek_ns)
-        self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, seek_ns)
+        self.transport.seek_relative(10 * Gst.SECOND)
+
+    def accurate_callback(self, w):
+        if w.props.active:
+            self.transport.set_mode(TransportController.MODE_ACCURATE)
+        else:
+            self.transport.set_mode(TransportController.MODE_KEY_UNIT)
 
     def convert_ns(self, t):
         # This method was submitted by Sam Mason.
@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import os
+import sys
+import time
+from threading import Lock
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+STARTED = time.monotonic()
+
+gst_lock = Lock()
+
+def init_gst():
+    ''' Initializes GStreamer on first use, safe to call from any thread '''
+    with gst_lock:
+        if not Gst.is_initialized():
+            Gst.init(None)
+
+
+class StartupProfile():
+    ''' Time from launch to the first frame, broken down by phase.
+
+    Enabled with SOUNDJAM_STARTUP_PROFILE=1, the report is printed to stderr
+    once background initialization is done. The first frame is checked
+    against BUDGET_MS, SOUNDJAM_STARTUP_BUDGET=<ms> overrides it.
+    '''
+
+    BUDGET_MS = 400
+    FIRST_FRAME = "first-frame"
+
+    default = None
+
+    def __init__(self, enabled=None, budget_ms=None, *args, **kwargs):
+
+        if enabled is None:
+            enabled = os.environ.get("SOUNDJAM_STARTUP_PROFILE", "") not in ("", "0")
+        if budget_ms is None:
+            try:
+                budget_ms = int(os.environ.get("SOUNDJAM_STARTUP_BUDGET", self.BUDGET_MS))
+            except ValueError:
+                budget_ms = self.BUDGET_MS
+        self.enabled = enabled
+        self.budget_ms = budget_ms
+        self.marks = [("start", STARTED)]
+        self.reported = False
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    def mark(self, phase):
+        ''' Records the end of phase, phases are timed from the previous mark '''
+        if self.enabled:
+            self.marks.append((phase, time.monotonic()))
+
+    def get_phases(self):
+        ''' Returns (phase, duration_ms, elapsed_ms) for every mark since launch '''
+        return [(phase, (end - start) * 1000, (end - STARTED) * 1000) for (_, start), (phase, end) in zip(self.marks, self.marks[1:])]
+
+    def report(self, file=sys.stderr):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+
+        phases = self.get_phases()
+        width = max([len(phase) for phase, duration, elapsed in phases] + [5])
+        print("soundjam startup profile", file=file)
+        for phase, duration, elapsed in phases:
+            print("  {0:<{1}} {2:8.1f} ms {3:8.1f} ms".format(phase, width, duration, elapsed), file=file)
+
+        first_frame = next((elapsed for phase, duration, elapsed in phases if phase == self.FIRST_FRAME), None)
+        if first_frame is not None:
+            status = "over budget" if first_frame > self.budget_ms else "ok"
+            print("  first frame at {0:.1f} ms, budget {1} ms, {2}".format(first_frame, self.budget_ms, status), file=file)
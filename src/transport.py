@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+class TransportController():
+    ''' Seeking and position tracking for one pipeline.
+
+    At most one flushing seek is in flight. Seeks requested while it runs
+    replace each other and only the last one is sent once the pipeline is
+    prerolled again, so mashing a button results in two seeks, not a storm
+    of flushes. Relative seeks add up from the latest requested target.
+
+    The position is queried at most every POSITION_MAX_AGE seconds and moved
+    along with the wall clock in between while playing. While a seek is
+    pending its target is reported.
+
+    The owner passes the pipeline bus messages to handle_message().
+    '''
+
+    MODE_KEY_UNIT = Gst.SeekFlags.KEY_UNIT
+    MODE_ACCURATE = Gst.SeekFlags.ACCURATE
+
+    POSITION_MAX_AGE = 0.25
+
+    def __init__(self, pipeline, mode=MODE_ACCURATE, *args, **kwargs):
+
+        self.pipeline = pipeline
+        self.mode = mode
+        self.seeking = False
+        self.pending = None
+        self.position = 0
+        self.position_time = None
+        self.duration = -1
+        self.playing = False
+
+    def set_mode(self, mode):
+        ''' MODE_KEY_UNIT lands on the nearest keyframe quickly, MODE_ACCURATE on the exact sample '''
+        self.mode = mode
+
+    def seek(self, position):
+        position = max(0, position)
+        duration = self.get_duration()
+        if duration > 0:
+            position = min(position, duration)
+        self.position = position
+        self.position_time = None
+        if self.seeking:
+            self.pending = position
+            return
+        self.send_seek(position)
+
+    def seek_relative(self, offset):
+        base = self.pending if self.pending is not None else self.get_position()
+        self.seek(base + offset)
+
+    def send_seek(self, position):
+        self.pending = None
+        self.seeking = self.pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | self.mode, position)
+        if not self.seeking:
+            # not prerolled yet, it's sent on the next ASYNC_DONE
+            self.pending = position
+
+    def get_position(self):
+        ''' Returns the position in ns, the seek target while seeking and -1 if unknown '''
+        if self.seeking or self.pending is not None:
+            return self.position
+        now = time.monotonic()
+        if self.position_time is not None and now - self.position_time < self.POSITION_MAX_AGE:
+            if self.playing:
+                return self.position + int((now - self.position_time) * Gst.SECOND)
+            return self.position
+        ok, position = self.pipeline.query_position(Gst.Format.TIME)
+        if not ok:
+            return -1
+        self.position = position
+        self.position_time = now
+        return position
+
+    def get_duration(self):
+        if self.duration < 0:
+            ok, duration = self.pipeline.query_duration(Gst.Format.TIME)
+            if ok:
+                self.duration = duration
+        return self.duration
+
+    def invalidate(self):
+        ''' Forgets the cached position and duration, for when the stream is changed or seeked elsewhere '''
+        self.position_time = None
+        self.duration = -1
+
+    def handle_message(self, message):
+        if message.type == Gst.MessageType.ASYNC_DONE:
+            self.seeking = False
+            self.position_time = None
+            if self.pending is not None:
+                self.send_seek(self.pending)
+        elif message.type == Gst.MessageType.STATE_CHANGED and message.src == self.pipeline:
+            old, new, pending = message.parse_state_changed()
+            self.playing = new == Gst.State.PLAYING
+            self.position_time = None
+        elif message.type == Gst.MessageType.DURATION_CHANGED:
+            self.duration = -1
+        elif message.type in (Gst.MessageType.EOS, Gst.MessageType.ERROR):
+            self.seeking = False
+            self.pending = None
+            self.position_time = None
@@ -1,7 +1,16 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
 
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from threading import Lock
+
+from gi.repository import GLib
+
+from .instrumentation import Instrumentation
 
 class HelperUtils:
     @staticmethod
@@ -11,7 +20,7 @@ class HelperUtils:
         http://code.activestate.com/recipes/576683-simple-threading-decorator/
         run_async(func): 
         function decorator, intended to make "func" run in a separate thread (asynchronously).
-        Returns the created Thread object
+        Calls are queued on the shared TaskExecutor, use TaskExecutor.submit directly for a Future
         Example:
             @run_async
             def task1():
@@ -20,15 +29,137 @@ class HelperUtils:
             def task2():
                 do_something_too
         '''
-        from threading import Thread
         from functools import wraps
 
         @wraps(func)
         def async_func(*args, **kwargs):
-            func_hl = Thread(target=func, args=args, kwargs=kwargs)
-            func_hl.start()
+            TaskExecutor.get_default().submit(func, *args, **kwargs)
             # Never return anything, idle_add will think it should re-run the
             # function because it's a non-False value.
             return None
 
         return async_func
+
+
+class TaskExecutor():
+    ''' The application-wide pool for background work.
+
+    Tasks run on a fixed number of worker threads and return a Future that
+    can be cancelled or waited on. When a callback is given it is called on
+    the main loop with the finished future, unless the task was cancelled.
+    Exceptions from tasks without a callback are printed rather than lost.
+    Queue depth and queue/run latencies are kept for stats().
+
+    Work that must not wait behind the decodes queued on the default pool,
+    like imports, runs on its own lane from get_lane().
+    '''
+
+    default = None
+    lanes = {}
+
+    def __init__(self, workers=None, name="task", *args, **kwargs):
+
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="soundjam-{0}".format(name))
+        self.lock = Lock()
+        self.futures = set()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_wait_time = 0.0
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+            Instrumentation.get_default().add_gauge("tasks", cls.default.stats)
+        return cls.default
+
+    @classmethod
+    def get_lane(cls, name, workers=1):
+        ''' Returns the executor for the lane name, created with workers threads on first use '''
+        if name not in cls.lanes:
+            cls.lanes[name] = cls(workers, name)
+            Instrumentation.get_default().add_gauge("tasks_{0}".format(name), cls.lanes[name].stats)
+        return cls.lanes[name]
+
+    @classmethod
+    def shutdown_all(cls):
+        for executor in [cls.default] + list(cls.lanes.values()):
+            if executor is not None:
+                executor.shutdown()
+
+    def submit(self, func, *args, callback=None, **kwargs):
+        ''' Runs func(*args, **kwargs) on a worker, calling callback(future) on the main loop when it's done '''
+        submitted = time.monotonic()
+        with self.lock:
+            self.queued += 1
+        future = self.executor.submit(self.run_task, func, submitted, args, kwargs)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(lambda future: self.on_task_done(future, callback))
+        return future
+
+    def run_task(self, func, submitted, args, kwargs):
+        started = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_time += started - submitted
+            self.max_wait_time = max(self.max_wait_time, started - submitted)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.run_time += time.monotonic() - started
+
+    def on_task_done(self, future, callback):
+        with self.lock:
+            self.futures.discard(future)
+            if future.cancelled():
+                self.queued -= 1
+                self.cancelled += 1
+                return
+            if future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        if callback is not None:
+            GLib.idle_add(self.deliver, future, callback)
+        elif future.exception() is not None:
+            error = future.exception()
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def deliver(self, future, callback):
+        callback(future)
+        return False
+
+    def shutdown(self, wait=False):
+        ''' Stops the workers, queued tasks are cancelled so quitting doesn't wait for them '''
+        # cancel_futures needs Python 3.9, newer than the runtime ships
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "mean_wait_ms": self.wait_time / finished * 1000 if finished else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+                "mean_run_ms": self.run_time / finished * 1000 if finished else 0.0,
+            }
@@ -0,0 +1,183 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
+
+import hashlib
+import importlib.util
+import os
+
+from gi.repository import GLib
+
+from .samplecache import DecodeError, decode_stream
+from .utils import TaskExecutor
+
+class PeakStore():
+    ''' Waveform peaks for clip thumbnails, computed once and memory-mapped from disk.
+
+    Each clip is decoded once to low-rate mono PCM and reduced to BINS
+    (min, max) pairs with NumPy, buffer by buffer as it decodes, so the whole
+    clip is covered in bounded memory. Bins are sized from the stream duration.
+    If that is unknown or too short they are merged pairwise and widened as
+    the clip goes on. The pairs are written to a peak file named
+    after the clip path, size and mtime. Later lookups memory-map that file
+    read-only, so every tile drawing the same clip shares one page-cache copy.
+    Thumbnails are disabled when NumPy isn't installed.
+
+    NumPy is imported on first use and requests wait until start() is
+    called, so neither it nor GStreamer load before the first frame.
+    '''
+
+    BINS = 128
+    RATE = 8000
+    CAPS = "audio/x-raw,format=S16LE,layout=interleaved,rate={0},channels=1".format(RATE)
+
+    default = None
+
+    def __init__(self, path=None, *args, **kwargs):
+
+        self.path = path or os.path.join(GLib.get_user_cache_dir(), "soundjam", "peaks")
+        self.peaks = {}
+        self.pending = {}
+        self.waiting = []
+        self.started = False
+        self.numpy = None
+        # only looked up here, the import itself waits until peaks are needed
+        self.has_numpy = importlib.util.find_spec("numpy") is not None
+
+    @classmethod
+    def get_default(cls):
+        if cls.default is None:
+            cls.default = cls()
+        return cls.default
+
+    @property
+    def available(self):
+        return self.has_numpy
+
+    def get_numpy(self):
+        if self.numpy is None:
+            import numpy
+            self.numpy = numpy
+        return self.numpy
+
+    def start(self):
+        self.started = True
+        waiting, self.waiting = self.waiting, []
+        for uri, callback in waiting:
+            self.request(uri, callback)
+
+    def get_peak_path(self, uri):
+        try:
+            path, hostname = GLib.filename_from_uri(uri)
+            stat = os.stat(path)
+        except (GLib.Error, OSError):
+            return None
+        key = "{0}:{1}:{2}".format(path, stat.st_size, stat.st_mtime_ns)
+        return os.path.join(self.path, hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".peaks")
+
+    def open(self, peak_path):
+        numpy = self.get_numpy()
+        return numpy.memmap(peak_path, dtype=numpy.int16, mode="r", shape=(self.BINS, 2))
+
+    def request(self, uri, callback):
+        ''' Calls callback(peaks) with a (BINS, 2) array of min/max values, computing them first if needed '''
+        if not self.started:
+            self.waiting.append((uri, callback))
+            return
+        if not self.available:
+            return
+        if uri in self.peaks:
+            callback(self.peaks[uri])
+            return
+        if uri in self.pending:
+            self.pending[uri].append(callback)
+            return
+
+        peak_path = self.get_peak_path(uri)
+        if peak_path is None:
+            return
+        if os.path.exists(peak_path):
+            self.peaks[uri] = self.open(peak_path)
+            callback(self.peaks[uri])
+            return
+
+        self.pending[uri] = [callback]
+        TaskExecutor.get_default().submit(self.compute, uri, peak_path, callback=lambda future: self.deliver(uri, future))
+
+    def forget(self, uris):
+        ''' Drops the peaks of uris and the callbacks waiting for them, peaks still computing are thrown away '''
+        uris = set(uris)
+        self.waiting = [(uri, callback) for uri, callback in self.waiting if uri not in uris]
+        for uri in uris:
+            self.peaks.pop(uri, None)
+            self.pending.pop(uri, None)
+
+    def compute(self, uri, peak_path):
+        numpy = self.get_numpy()
+        # up to twice BINS bins of width samples each, used of them filled so far
+        mins = numpy.zeros(2 * self.BINS, dtype=numpy.int16)
+        maxs = numpy.zeros(2 * self.BINS, dtype=numpy.int16)
+        width = None
+        used = 0
+        offset = 0
+
+        stream = decode_stream(uri, caps=self.CAPS)
+        try:
+            for data, duration in stream:
+                samples = numpy.frombuffer(data, dtype=numpy.int16)
+                if width is None:
+                    total = duration * self.RATE // 1000000000 if duration > 0 else 0
+                    width = max(1, -(-total // self.BINS))
+                position = 0
+                while position < samples.size:
+                    index = (offset + position) // width
+                    if index >= mins.size:
+                        # longer than expected, halve the resolution
+                        mins[:self.BINS] = numpy.minimum(mins[0::2], mins[1::2])
+                        maxs[:self.BINS] = numpy.maximum(maxs[0::2], maxs[1::2])
+                        mins[self.BINS:] = maxs[self.BINS:] = 0
+                        used = self.BINS
+                        width *= 2
+                        continue
+                    end = min(samples.size, (index + 1) * width - offset)
+                    low, high = samples[position:end].min(), samples[position:end].max()
+                    if index < used:
+                        mins[index] = min(mins[index], low)
+                        maxs[index] = max(maxs[index], high)
+                    else:
+                        mins[index], maxs[index] = low, high
+                        used = index + 1
+                    position = end
+                offset += samples.size
+        except DecodeError:
+            return None
+        finally:
+            stream.close()
+        if used == 0:
+            return None
+
+        if used > self.BINS:
+            # fold the bins into BINS groups of one or two
+            starts = numpy.linspace(0, used, self.BINS + 1).astype(int)[:-1]
+            mins = numpy.minimum.reduceat(mins[:used], starts)
+            maxs = numpy.maximum.reduceat(maxs[:used], starts)
+        peaks = numpy.stack((mins[:self.BINS], maxs[:self.BINS]), axis=1).astype(numpy.int16)
+
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = peak_path + ".tmp"
+        peaks.tofile(temp_path)
+        os.replace(temp_path, peak_path)
+        return self.open(peak_path)
+
+    def deliver(self, uri, future):
+        callbacks = self.pending.pop(uri, None)
+        if callbacks is None:
+            # forgotten meanwhile
+            return
+        if future.exception() is not None:
+            print(future.exception())
+            return
+        peaks = future.result()
+        if peaks is not None:
+            self.peaks[uri] = peaks
+            for callback in callbacks:
+                callback(peaks)
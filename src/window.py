@@ -1,10 +1,12 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2021 Adi Hezral <hezral@gmail.com>
 
+from functools import partial
 from inspect import currentframe, getframeinfo
+from itertools import groupby
 
+import math
 import os
-import time
 
 import gi
 gi.require_version('Handy', '1')
@@ -12,19 +14,57 @@ gi.require_version('Gtk', '3.0')
 gi.require_version('Granite', '1.0')
 from gi.repository import Gtk, Handy, GLib, Gdk, Granite, Pango, Gio, GdkPixbuf, cairo
 
-from .custom_widgets import HoldButton
-from .playsoundy import Playsoundy, play
-from .utils import HelperUtils
+from .custom_widgets import HoldButton, CircularProgressBar
+from .playsoundy import VoicePool, play
+from .samplecache import SampleCache
+from .importer import ImportJob
+from .library import Library
+from .clips import Clip, ClipItem, close_clips
+from .metadata import MetadataService
+from .waveform import PeakStore
+from .startup import StartupProfile, init_gst
+from .utils import TaskExecutor
 
 class soundjamWindow(Handy.ApplicationWindow):
     __gtype_name__ = 'soundjamWindow'
 
     Handy.init()
 
+    RESTORE_FIRST = 48
+    RESTORE_BATCH = 64
+    OVERSCAN_ROWS = 2
+
+    # keyboard rows mapped to the first slots of the active bank, F1-F10 switch banks
+    SLOT_KEYS = "1234567890qwertyuiopasdfghjkl;zxcvbnm,./"
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.app = self.props.application
+        self.import_job = None
+        # uri -> {bank: item}, the same sample can be on several banks
+        self.soundclips = {}
+        self.digests = {}
+        self.library = Library()
+        self.metadata = MetadataService.get_default()
+        self.peak_store = PeakStore.get_default()
+        self.banks = [Gio.ListStore.new(ClipItem) for bank in range(Library.BANKS)]
+        for store in self.banks:
+            store.connect("items-changed", self.on_bank_items_changed)
+        self.bank = 0
+        self.store = self.banks[self.bank]
+        self.preload_id = 0
+        self.bound_soundclips = set()
+        self.visible_update_id = 0
+        self.progress_tick_id = 0
+        self.first_paint_handler_id = 0
+        self.restore_queue = []
+
+        VoicePool.get_default().set_polyphony(self.app.gio_settings.get_int("polyphony"))
+        VoicePool.get_default().set_policy(self.app.gio_settings.get_string("playback-policy"), self.app.gio_settings.get_int("warm-clips"))
+        VoicePool.get_default().set_engine(self.app.gio_settings.get_string("engine"))
+        SampleCache.get_default().set_budget(self.app.gio_settings.get_int("sample-cache-size") * 1024 * 1024)
+        self.app.gio_settings.connect("changed::normalize-loudness", self.on_normalize_loudness_changed)
 
         self.header = self.generate_headerbar()
         self.start_view = self.generate_start_view()
@@ -76,9 +116,49 @@ class soundjamWindow(Handy.ApplicationWindow):
         self.drag_and_drop_setup(self)
         self.drag_and_grab_setup(self.soundboard_view)
 
-        self.add_to_soundboard(data=None)
+        self.connect("destroy", self.on_destroy)
+        self.connect("key-press-event", self.on_key_press)
+
+        if hasattr(Gio, "MemoryMonitor"):
+            self.memory_monitor = Gio.MemoryMonitor.dup_default()
+            self.memory_monitor.connect("low-memory-warning", self.on_low_memory_warning)
+
+        self.restore_soundboard()
+
+        # gstreamer and clip probing start once the first frame is on screen
+        self.add_tick_callback(self.on_first_frame)
+
+    def on_first_frame(self, widget, frame_clock):
+        self.first_paint_handler_id = frame_clock.connect("after-paint", self.on_first_paint)
+        return GLib.SOURCE_REMOVE
+
+    def on_first_paint(self, frame_clock):
+        frame_clock.disconnect(self.first_paint_handler_id)
+        self.first_paint_handler_id = 0
+        StartupProfile.get_default().mark(StartupProfile.FIRST_FRAME)
+        GLib.idle_add(self.init_subsystems, priority=GLib.PRIORITY_LOW)
+
+    def init_subsystems(self):
+        TaskExecutor.get_default().submit(init_gst, callback=self.on_subsystems_ready)
+        return False
+
+    def on_subsystems_ready(self, future):
+        StartupProfile.get_default().mark("gstreamer")
+        self.metadata.start()
+        self.peak_store.start()
+        self.queue_preload()
+        StartupProfile.get_default().report()
+
+    def on_destroy(self, window):
+        if self.import_job is not None:
+            self.import_job.cancel()
+        self.library.flush()
+        self.metadata.flush()
+        VoicePool.get_default().close()
+        TaskExecutor.shutdown_all()
 
     def on_scroll(self, vadjustment, value):
+        self.queue_update_visible()
         if vadjustment.props.value > 0.8 * (vadjustment.props.upper - vadjustment.props.page_size):
             self.header.get_style_context().add_class("hidden")
             self.header.set_visible(False)
@@ -90,8 +170,28 @@ class soundjamWindow(Handy.ApplicationWindow):
 
     def generate_headerbar(self):
 
-        self.spinbutton = Gtk.SpinButton().new_with_range(min=1, max=10, step=1)
+        self.spinbutton = Gtk.SpinButton().new_with_range(min=1, max=Library.BANKS, step=1)
         self.spinbutton.props.can_focus = False
+        self.spinbutton.props.tooltip_text = "Bank, F1–F10 to switch"
+        self.spinbutton.connect("value-changed", self.on_bank_changed)
+
+        self.import_progress = Gtk.ProgressBar()
+        self.import_progress.props.valign = Gtk.Align.CENTER
+        self.import_progress.props.show_text = True
+
+        import_cancel = Gtk.Button(image=Gtk.Image().new_from_icon_name("process-stop-symbolic", Gtk.IconSize.SMALL_TOOLBAR))
+        import_cancel.props.can_focus = False
+        import_cancel.props.tooltip_text = "Cancel import"
+        import_cancel.connect("clicked", self.on_import_cancel)
+
+        import_grid = Gtk.Grid()
+        import_grid.props.column_spacing = 6
+        import_grid.attach(self.import_progress, 0, 0, 1, 1)
+        import_grid.attach(import_cancel, 1, 0, 1, 1)
+
+        self.import_revealer = Gtk.Revealer()
+        self.import_revealer.props.transition_type = Gtk.RevealerTransitionType.CROSSFADE
+        self.import_revealer.add(import_grid)
 
         header = Handy.HeaderBar()
         header.props.name = "main"
@@ -102,6 +202,7 @@ class soundjamWindow(Handy.ApplicationWindow):
         header.props.has_subtitle = False
         header.props.show_close_button = True
         header.props.decoration_layout = "close:"
+        header.pack_start(self.import_revealer)
         header.pack_end(self.spinbutton)
         return header
 
@@ -135,9 +236,66 @@ class soundjamWindow(Handy.ApplicationWindow):
         soundboard.props.valign = Gtk.Align.START
         soundboard.props.halign = Gtk.Align.FILL
         soundboard.props.selection_mode = Gtk.SelectionMode.NONE
+        soundboard.bind_model(self.store, self.create_soundclip_widget)
         soundboard.connect("child-activated", self.on_flowboxchild_activated)
+        soundboard.connect("size-allocate", self.queue_update_visible)
         return soundboard
 
+    def create_soundclip_widget(self, item):
+        if item.placeholder:
+            grid = Gtk.Grid()
+            grid.props.expand = True
+            grid.set_size_request(160, 120)
+            # grid.get_style_context().add_class("clip-containers")
+            eventbox = Gtk.EventBox()
+            eventbox.props.name = "placeholders"
+            # activation and drag handlers look the item up on every cell
+            eventbox.item = item
+            eventbox.props.expand = True
+            eventbox.set_size_request(160, 120)
+            # eventbox.get_style_context().add_class("clip-containers")
+            eventbox.add(grid)
+            eventbox.connect("enter-notify-event", self.on_hover_enter)
+            eventbox.connect("leave-notify-event", self.on_hover_leave)
+            eventbox.show_all()
+            return eventbox
+        soundclip = SoundClip(item)
+        soundclip.show()
+        return soundclip
+
+    def queue_update_visible(self, *args):
+        if self.visible_update_id == 0:
+            self.visible_update_id = GLib.idle_add(self.update_visible_soundclips)
+
+    def update_visible_soundclips(self):
+        ''' Bind tile content for the rows on screen, plus some overscan, and recycle the rest '''
+        self.visible_update_id = 0
+        visible = set()
+
+        first = self.soundboard_view.get_child_at_index(0)
+        if first is not None and first.get_allocated_width() > 1:
+            allocation = first.get_allocation()
+            row_height = allocation.height + self.soundboard_view.props.row_spacing
+            column_width = allocation.width + self.soundboard_view.props.column_spacing
+            width = self.soundboard_view.get_allocated_width() - self.soundboard_view.props.margin_left - self.soundboard_view.props.margin_right
+            per_line = max(1, min(self.soundboard_view.props.max_children_per_line, (width + self.soundboard_view.props.column_spacing) // column_width))
+
+            top = self.vadjustment.props.value - allocation.y
+            first_row = max(0, int(top // row_height) - self.OVERSCAN_ROWS)
+            last_row = int((top + self.vadjustment.props.page_size) // row_height) + self.OVERSCAN_ROWS
+
+            for index in range(first_row * per_line, min(self.store.get_n_items(), (last_row + 1) * per_line)):
+                child = self.soundboard_view.get_child_at_index(index)
+                soundclip = child.get_child() if child is not None else None
+                if isinstance(soundclip, SoundClip):
+                    soundclip.bind()
+                    visible.add(soundclip)
+
+        for soundclip in self.bound_soundclips - visible:
+            soundclip.unbind()
+        self.bound_soundclips = visible
+        return False
+
     def generate_settings_view(self):
         settings = Gtk.Grid()
         settings.props.name = "settings"
@@ -167,7 +325,7 @@ class soundjamWindow(Handy.ApplicationWindow):
         print("on_drag_data_received")
 
     def on_drag_data_grabbed(self, widget, drag_context):
-        uris = []
+        items = []
         for child in widget.get_selected_children():
             # child.get_children()[0].icon_grid.hide()
             # child.get_children()[0].icon_label.hide()
@@ -175,57 +333,296 @@ class soundjamWindow(Handy.ApplicationWindow):
             # child.get_children()[0].poof.on_show()
             # self.on_soundclip_removed(child)
             # GLib.timeout_add(1000, self.on_soundclip_removed, child)
-            child.destroy()
-            # if child.get_children()[0].uri != None:
-            #     uris.append(child.get_children()[0].uri)
-        # print(uris)
+            items.append(child.get_child().item)
+        self.remove_soundclips(items)
         # self.off_select_mode()
 
-    @HelperUtils.run_async
     def add_to_soundboard(self, data):
         if data is not None:
-            for child in self.soundboard_view.get_children():
-                print(child.get_children()[0].props.name)
-                if child.get_children()[0].props.name == "placeholders":
-                    child.destroy()
+            self.remove_placeholders()
             target = data.get_target()
             # print(str(target))
             if str(target) == "text/uri-list":
-                uris = data.get_uris()
-                for uri in uris:
-                    path, hostname = GLib.filename_from_uri(uri)
-                    if os.path.exists(path):
-                        if os.path.isfile(path):
-                            mime_type, val = Gio.content_type_guess(path, data=None)
-                            if "audio" in mime_type:
-                                GLib.idle_add(self.add_soundclip, uri)
-                                time.sleep(0.05)
-                                print("add_to_soundboard")
+                if self.import_job is not None:
+                    self.import_job.cancel()
+                hashing = self.app.gio_settings.get_boolean("dedupe-by-content")
+                # clips land in the bank they were dropped on, even if another one is shown meanwhile
+                on_clips = partial(self.add_soundclips, bank=self.bank)
+                self.import_job = ImportJob(data.get_uris(), on_clips, hashing=hashing)
+                # a replaced job still reports in later, the callbacks tell it apart from the current one
+                self.import_job.on_progress = partial(self.on_import_progress, self.import_job)
+                self.import_job.on_done = partial(self.on_import_done, self.import_job)
+                self.import_progress.props.fraction = 0
+                self.import_progress.props.text = None
+                self.import_revealer.set_reveal_child(True)
+                self.import_job.start()
         else:
-            for i in range(12):
-                grid = Gtk.Grid()
-                grid.props.expand = True
-                grid.set_size_request(160, 120)
-                # grid.get_style_context().add_class("clip-containers")
-                eventbox = Gtk.EventBox()
-                eventbox.props.name = "placeholders"
-                eventbox.props.expand = True
-                eventbox.set_size_request(160, 120)
-                # eventbox.get_style_context().add_class("clip-containers")
-                eventbox.add(grid)
-                eventbox.connect("enter-notify-event", self.on_hover_enter)
-                eventbox.connect("leave-notify-event", self.on_hover_leave)
-                self.soundboard_view.add(eventbox)
-                self.soundboard_view.show_all()
-                self.stack.set_visible_child(self.scrolled_window)
-
-    def add_soundclip(self, uri):
-        try:
-            duplicate = [child for child in self.soundboard_view.get_children() if child.get_children()[0].uri == uri][0]
-        except:
-            self.soundboard_view.add(SoundClip(uri))
-        self.soundboard_view.show_all()
-        # self.scrolled_window.show_all()
+            self.store.splice(0, 0, [ClipItem() for i in range(12)])
+            self.stack.set_visible_child(self.scrolled_window)
+
+    def remove_placeholders(self):
+        for position in reversed(range(self.store.get_n_items())):
+            if self.store.get_item(position).placeholder:
+                self.store.remove(position)
+
+    def create_clip_item(self, bank, uri, digest=None, settings=None):
+        if self.is_duplicate(bank, uri, digest):
+            return None
+        clip = Clip(uri, digest, settings)
+        item = ClipItem(clip)
+        self.soundclips.setdefault(uri, {})[bank] = item
+        if digest is not None:
+            self.digests[(bank, digest)] = uri
+        self.metadata.request(uri, clip.set_metadata)
+        # analysis decodes the whole file, only worth it when the result is used
+        if self.app.gio_settings.get_boolean("normalize-loudness"):
+            self.metadata.request_loudness(uri, partial(self.on_loudness, clip))
+        self.peak_store.request(uri, clip.set_peaks)
+        item.connect("notify::playing", self.on_item_playing_changed)
+        item.connect("notify::loop", self.on_item_loop_changed)
+        return item
+
+    def add_soundclip(self, uri, digest=None):
+        item = self.create_clip_item(self.bank, uri, digest)
+        if item is not None:
+            self.store.append(item)
+            self.library.schedule_save(self.get_library_entries)
+        return item
+
+    def add_soundclips(self, clips, bank=None):
+        bank = self.bank if bank is None else bank
+        store = self.banks[bank]
+        items = [item for item in (self.create_clip_item(bank, uri, digest) for uri, digest in clips) if item is not None]
+        store.splice(store.get_n_items(), 0, items)
+        self.library.schedule_save(self.get_library_entries)
+
+    def restore_soundboard(self):
+        bank, banks = self.library.load()
+        if not any(banks):
+            self.add_to_soundboard(data=None)
+            return
+        # restore what fits on screen of the active bank right away and the rest while idle
+        self.restore_soundclips(bank, banks[bank][:self.RESTORE_FIRST])
+        self.set_bank(bank)
+        self.stack.set_visible_child(self.scrolled_window)
+        self.restore_queue = [(bank, entry) for entry in banks[bank][self.RESTORE_FIRST:]]
+        self.restore_queue += [(index, entry) for index, entries in enumerate(banks) if index != bank for entry in entries]
+        if self.restore_queue:
+            GLib.idle_add(self.on_restore_idle)
+
+    def restore_soundclips(self, bank, entries):
+        items = (self.create_clip_item(bank, entry["uri"], entry.get("digest"), entry.get("settings")) for entry in entries)
+        store = self.banks[bank]
+        store.splice(store.get_n_items(), 0, [item for item in items if item is not None])
+
+    def on_restore_idle(self):
+        batch = self.restore_queue[:self.RESTORE_BATCH]
+        del self.restore_queue[:self.RESTORE_BATCH]
+        for bank, entries in groupby(batch, key=lambda queued: queued[0]):
+            self.restore_soundclips(bank, [entry for index, entry in entries])
+        return len(self.restore_queue) > 0
+
+    def get_library_entries(self):
+        banks = []
+        for store in self.banks:
+            items = (store.get_item(position) for position in range(store.get_n_items()))
+            banks.append([item.clip.to_entry() for item in items if not item.placeholder])
+        for bank, entry in self.restore_queue:
+            banks[bank].append(entry)
+        return self.bank, banks
+
+    def get_bank_items(self, bank):
+        store = self.banks[bank]
+        items = (store.get_item(position) for position in range(store.get_n_items()))
+        return [item for item in items if not item.placeholder]
+
+    def set_bank(self, bank):
+        ''' Shows bank on the board and preloads its clips '''
+        if bank == self.bank:
+            return
+        for soundclip in self.bound_soundclips:
+            soundclip.unbind()
+        self.bound_soundclips = set()
+
+        self.bank = bank
+        self.store = self.banks[bank]
+        self.soundboard_view.bind_model(self.store, self.create_soundclip_widget)
+        if self.spinbutton.get_value_as_int() != bank + 1:
+            self.spinbutton.set_value(bank + 1)
+        if self.store.get_n_items() == 0:
+            self.add_to_soundboard(data=None)
+        self.vadjustment.props.value = 0
+        self.queue_update_visible()
+        self.queue_preload()
+
+    def on_bank_changed(self, spinbutton):
+        bank = spinbutton.get_value_as_int() - 1
+        if bank != self.bank:
+            self.set_bank(bank)
+            self.library.schedule_save(self.get_library_entries)
+
+    def on_bank_items_changed(self, store, position, removed, added):
+        if store is self.store:
+            self.queue_update_visible()
+
+    def queue_preload(self):
+        if self.preload_id == 0:
+            self.preload_id = GLib.idle_add(self.on_preload_idle, priority=GLib.PRIORITY_LOW)
+
+    def on_preload_idle(self):
+        ''' Decodes the hotkey slots of the active bank and prerolls voices for the first of them '''
+        self.preload_id = 0
+        # voices need gstreamer, which is brought up after the first frame
+        if not self.metadata.started:
+            return False
+        voices = VoicePool.get_default().warm_clips
+        for slot, item in enumerate(self.get_bank_items(self.bank)[:len(self.SLOT_KEYS)]):
+            item.clip.player.preload(voice=slot < voices)
+        return False
+
+    def on_low_memory_warning(self, monitor, level):
+        ''' Gives back the decoded samples and parked voices of every bank not on screen '''
+        items = [item for bank in range(len(self.banks)) if bank != self.bank for item in self.get_bank_items(bank)]
+        VoicePool.get_default().release([item.clip.player for item in items])
+        # samples are shared by uri, keep those a clip on screen uses too
+        SampleCache.get_default().discard([item.uri for item in items if self.bank not in self.soundclips.get(item.uri, {})])
+
+    def on_key_press(self, widget, eventkey):
+        if eventkey.state & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK | Gdk.ModifierType.SUPER_MASK):
+            return Gdk.EVENT_PROPAGATE
+        if Gdk.KEY_F1 <= eventkey.keyval < Gdk.KEY_F1 + len(self.banks):
+            self.set_bank(eventkey.keyval - Gdk.KEY_F1)
+            self.library.schedule_save(self.get_library_entries)
+            return Gdk.EVENT_STOP
+        slot = self.SLOT_KEYS.find(chr(Gdk.keyval_to_unicode(eventkey.keyval)).lower())
+        if slot < 0:
+            return Gdk.EVENT_PROPAGATE
+        item = self.get_soundclip_at(slot)
+        if item is not None:
+            item.clip.player.play_pause()
+        return Gdk.EVENT_STOP
+
+    def is_duplicate(self, bank, uri, digest=None):
+        ''' Clips are unique within a bank, the same sample can be on several banks '''
+        return bank in self.soundclips.get(uri, {}) or (digest is not None and (bank, digest) in self.digests)
+
+    def get_soundclip(self, uri):
+        ''' Returns the item for uri on the active bank, or else on the first bank holding it '''
+        items = self.soundclips.get(uri)
+        if not items:
+            return None
+        return items.get(self.bank) or items[min(items)]
+
+    def get_soundclips(self):
+        return [item for items in self.soundclips.values() for item in items.values()]
+
+    def get_soundclip_at(self, position):
+        item = self.store.get_item(position) if 0 <= position < self.store.get_n_items() else None
+        if item is None or item.placeholder:
+            return None
+        return item
+
+    def stop_soundclips(self):
+        clips = [item.clip for item in self.get_soundclips() if item.clip.player.playing]
+        for clip in clips:
+            clip.player.stop()
+        return len(clips)
+
+    def get_status(self):
+        items = (self.store.get_item(position) for position in range(self.store.get_n_items()))
+        return {
+            "clips": [{"id": position, "uri": item.uri, "name": item.name, "playing": item.clip.playing} for position, item in enumerate(items) if not item.placeholder],
+            "voices": len(VoicePool.get_default().get_active_voices()),
+        }
+
+    def remove_soundclip(self, uri):
+        item = self.get_soundclip(uri)
+        if item is not None:
+            self.remove_soundclips([item])
+
+    def remove_soundclips(self, items):
+        ''' Takes items off the board and releases their voices, samples and analysis in one batch '''
+        positions = []
+        clips = []
+        for item in items:
+            by_bank = self.soundclips.get(item.uri, {})
+            bank = next((bank for bank, other in by_bank.items() if other is item), None)
+            if bank is None:
+                continue
+            found, position = self.banks[bank].find(item)
+            if not found:
+                continue
+            del by_bank[bank]
+            if not by_bank:
+                del self.soundclips[item.uri]
+            positions.append((self.banks[bank], position))
+            clip = item.clip
+            clips.append(clip)
+            if clip.digest is not None and self.digests.get((bank, clip.digest)) == clip.uri:
+                del self.digests[(bank, clip.digest)]
+        for store, position in sorted(positions, key=lambda found: found[1], reverse=True):
+            store.remove(position)
+        # uris still on another bank keep their shared samples and analysis
+        close_clips(clips, list({clip.uri for clip in clips if clip.uri not in self.soundclips}))
+        self.library.schedule_save(self.get_library_entries)
+
+    def on_loudness(self, clip, loudness):
+        if loudness is not None:
+            clip.set_loudness(loudness)
+            clip.player.set_volume(clip.get_volume(self.app.gio_settings.get_boolean("normalize-loudness")))
+
+    def on_normalize_loudness_changed(self, settings, key):
+        normalize = settings.get_boolean(key)
+        for item in self.get_soundclips():
+            if normalize and item.clip.loudness is None:
+                self.metadata.request_loudness(item.uri, partial(self.on_loudness, item.clip))
+            item.clip.player.set_volume(item.clip.get_volume(normalize))
+
+    def on_item_loop_changed(self, item, pspec):
+        self.library.schedule_save(self.get_library_entries)
+
+    def on_item_playing_changed(self, item, pspec):
+        if not item.props.playing:
+            item.clip.set_progress(0.0)
+        elif self.progress_tick_id == 0:
+            self.progress_tick_id = self.soundboard_view.add_tick_callback(self.on_progress_tick)
+
+    def on_progress_tick(self, widget, frame_clock):
+        ''' One tick per frame updates the progress of every playing clip, and stops when nothing plays '''
+        voices = VoicePool.get_default().get_active_voices()
+        if not voices:
+            self.progress_tick_id = 0
+            return GLib.SOURCE_REMOVE
+        for voice in voices:
+            clip = voice.owner.soundclip
+            position, duration = voice.query_progress()
+            if duration <= 0 and clip.metadata is not None:
+                duration = clip.metadata["duration"]
+            if position >= 0 and duration > 0:
+                clip.set_progress(min(1.0, position / duration))
+        return GLib.SOURCE_CONTINUE
+
+    def trigger_soundclip(self, uri):
+        item = self.get_soundclip(uri)
+        if item is not None:
+            item.clip.player.play_pause()
+        return item is not None
+
+    def on_import_progress(self, job, done, found):
+        if job is not self.import_job:
+            return
+        self.import_progress.props.fraction = done / found if found else 0
+        self.import_progress.props.text = "{0} / {1}".format(done, found)
+
+    def on_import_done(self, job, cancelled):
+        if job is not self.import_job:
+            return
+        self.import_revealer.set_reveal_child(False)
+        self.import_job = None
+
+    def on_import_cancel(self, button):
+        if self.import_job is not None:
+            self.import_job.cancel()
 
     def on_hover_enter(self, eventbox, eventcrossing):
         # eventbox.get_style_context().add_class("hover")
@@ -238,7 +635,9 @@ class soundjamWindow(Handy.ApplicationWindow):
 
     def on_flowboxchild_activated(self, flowbox, flowboxchild):
         # if self.soundboard_view.props.selection_mode == Gtk.SelectionMode.NONE:
-        flowboxchild.get_children()[0].player.play_pause()
+        item = flowboxchild.get_child().item
+        if not item.placeholder:
+            item.clip.player.play_pause()
 
     def on_select_mode(self):
         if self.soundboard_view.props.selection_mode == Gtk.SelectionMode.NONE and len(self.soundboard_view.get_selected_children()) == 0:
@@ -279,15 +678,113 @@ class soundjamWindow(Handy.ApplicationWindow):
         self.soundboard_view.props.selection_mode = Gtk.SelectionMode.NONE
 
 class SoundClip(Gtk.EventBox):
-    def __init__(self, uri, *args, **kwargs):
+    ''' Board tile for a ClipItem.
+
+    The tile only reserves its cell in the grid. The widgets drawing the clip
+    are bound to it while it is on screen and recycled once it scrolls away.
+    '''
+
+    TILE_WIDTH = 140
+    TILE_HEIGHT = 160
+    MAX_RECYCLED = 256
+
+    recycled = []
+
+    def __init__(self, item, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.uri = uri
-        self.player = Playsoundy(self)
+        self.item = item
+        self.content = None
+
+        self.set_size_request(self.TILE_WIDTH, self.TILE_HEIGHT)
+        self.props.can_focus = False
+        self.props.name = item.name
+
+        self.connect("enter-notify-event", self.on_enter_notify)
+        self.connect("leave-notify-event", self.on_leave_notify)
+        self.connect("destroy", self.on_destroy)
+        # self.connect("button-press-event", self.on_mouse_clicked)
+        # self.connect("key-press-event", self.on_keyboard_pressed)
+
+    @property
+    def uri(self):
+        return self.item.uri
+
+    def bind(self):
+        if self.content is not None:
+            return
+        if self.recycled:
+            self.content = self.recycled.pop()
+        else:
+            self.content = SoundClipContent()
+        self.content.bind(self.item, self.get_parent().is_selected())
+        self.add(self.content)
+        self.content.show_all()
+
+    def unbind(self):
+        if self.content is None:
+            return
+        content = self.content
+        self.content = None
+        self.remove(content)
+        content.unbind()
+        if len(self.recycled) < self.MAX_RECYCLED:
+            self.recycled.append(content)
+
+    def on_destroy(self, widget):
+        # the content goes down with the tile, only drop its hold on the item
+        if self.content is not None:
+            self.content.unbind()
+            self.content = None
+
+    # def on_keyboard_pressed(self, *args):
+    #     print(locals())
+    #     # self.player.play_pause()
+
+    # def on_mouse_clicked(self, eventbox, eventbutton):
+    #     if eventbutton.button == 1:
+    #         self.player.play_pause()
+
+    def on_enter_notify(self, widget, eventcrossing):
+        if self.content is not None:
+            self.content.select_revealer.set_reveal_child(True)
+            self.content.loop_revealer.set_reveal_child(True)
+
+    def on_leave_notify(self, widget, eventcrossing):
+        if self.content is not None and not self.get_parent().is_selected():
+            self.content.select_revealer.set_reveal_child(False)
+        if self.content is not None:
+            self.content.loop_revealer.set_reveal_child(self.item.props.loop)
 
-        path, hostname = GLib.filename_from_uri(uri)
+class SoundClipContent(Gtk.Overlay):
+    ''' The widgets drawing a clip on its tile, rebound to another ClipItem when recycled '''
 
-        filename = os.path.splitext(os.path.basename(path))[0]
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.item = None
+        self.playing_handler_id = 0
+        self.metadata_handler_id = 0
+        self.peaks_handler_id = 0
+        self.progress_handler_id = 0
+        self.loop_handler_id = 0
+
+        self.loop_button = Gtk.ToggleButton(image=Gtk.Image().new_from_icon_name("media-playlist-repeat-symbolic", Gtk.IconSize.SMALL_TOOLBAR))
+        self.loop_button.props.name = "soundclip-loop"
+        self.loop_button.props.can_focus = False
+        self.loop_button.props.tooltip_text = "Loop"
+        self.loop_button.get_style_context().add_class("soundclip-loop")
+        self.loop_button.get_style_context().add_class(Gtk.STYLE_CLASS_FLAT)
+        self.loop_toggled_handler_id = self.loop_button.connect("toggled", self.on_loop_toggled)
+        self.loop_revealer = Gtk.Revealer()
+        self.loop_revealer.props.can_focus = False
+        self.loop_revealer.props.halign = Gtk.Align.START
+        self.loop_revealer.props.valign = Gtk.Align.START
+        self.loop_revealer.props.margin_top = 4
+        self.loop_revealer.props.margin_left = 20
+        self.loop_revealer.props.transition_duration = 250
+        self.loop_revealer.props.transition_type = Gtk.RevealerTransitionType.CROSSFADE
+        self.loop_revealer.add(self.loop_button)
 
         select = Gtk.Button(image=Gtk.Image().new_from_icon_name("process-completed", Gtk.IconSize.LARGE_TOOLBAR))
         select.props.name = "soundclip-select"
@@ -313,8 +810,13 @@ class SoundClip(Gtk.EventBox):
         play.props.can_focus = False
         play.props.height_request = play.props.width_request = 48
         play.get_style_context().add_class("play")
+        self.progress = CircularProgressBar(size=48)
+        self.progress.props.show_text = False
+        self.progress.props.line_width = 3
+        self.progress.props.can_focus = False
         play_button_container = Gtk.Overlay()
         play_button_container.add(play)
+        play_button_container.add_overlay(self.progress)
         play_button_container.add_overlay(play_icon)
         self.play_revealer = Gtk.Revealer()
         self.play_revealer.props.can_focus = False
@@ -329,8 +831,15 @@ class SoundClip(Gtk.EventBox):
         self.icon_image = Gtk.Image().new_from_icon_name("io.elementary.music", Gtk.IconSize.DIALOG)
         self.icon_image.set_pixel_size(96)
         self.icon_image.props.can_focus = False
+        self.icon_image.props.no_show_all = True
 
-        self.icon_label = ItemLabel(filename)
+        self.waveform = Gtk.DrawingArea()
+        self.waveform.set_size_request(96, 96)
+        self.waveform.props.can_focus = False
+        self.waveform.props.no_show_all = True
+        self.waveform.connect("draw", self.on_waveform_draw)
+
+        self.icon_label = ItemLabel(None)
         self.icon_label.props.can_focus = False
 
         grid = Gtk.Grid()
@@ -341,50 +850,112 @@ class SoundClip(Gtk.EventBox):
         grid.props.halign = Gtk.Align.CENTER
         grid.props.valign = Gtk.Align.START
         grid.attach(self.icon_image, 0, 0, 1, 1)
+        grid.attach(self.waveform, 0, 0, 1, 1)
         grid.attach(self.icon_label, 0, 1, 1, 1)
         grid.set_size_request(128, 128)
 
         overlay_grid = Gtk.Grid()
         overlay_grid.props.can_focus = False
         overlay_grid.attach(self.select_revealer, 0, 0, 1, 1)
+        overlay_grid.attach(self.loop_revealer, 0, 0, 1, 1)
         overlay_grid.attach(self.play_revealer, 0, 0, 1, 1)
 
-        overlay = Gtk.Overlay()
-        overlay.props.can_focus = False
-        overlay.add(grid)
-        overlay.add_overlay(overlay_grid)
-
-        self.add(overlay)
         self.props.can_focus = False
-        self.props.name = filename
-
-        self.connect("enter-notify-event", self.on_enter_notify)
-        self.connect("leave-notify-event", self.on_leave_notify)
-        # self.connect("button-press-event", self.on_mouse_clicked)
-        # self.connect("key-press-event", self.on_keyboard_pressed)
+        self.add(grid)
+        self.add_overlay(overlay_grid)
+
+    def bind(self, item, selected):
+        self.item = item
+        self.icon_label.props.label = item.name
+        self.playing_handler_id = item.connect("notify::playing", self.on_playing_changed)
+        self.metadata_handler_id = item.connect("notify::metadata", self.on_metadata_changed)
+        self.peaks_handler_id = item.connect("notify::peaks", self.on_peaks_changed)
+        self.progress_handler_id = item.connect("notify::progress", self.on_progress_changed)
+        self.loop_handler_id = item.connect("notify::loop", self.on_loop_changed)
+        self.progress.props.percentage = item.props.progress
+        self.set_loop(item.props.loop)
+        self.set_playing(item.props.playing)
+        self.set_peaks(item.props.peaks)
+        self.props.tooltip_text = item.get_description()
+        self.select_revealer.set_reveal_child(selected)
+
+    def unbind(self):
+        self.item.disconnect(self.playing_handler_id)
+        self.item.disconnect(self.metadata_handler_id)
+        self.item.disconnect(self.peaks_handler_id)
+        self.item.disconnect(self.progress_handler_id)
+        self.item.disconnect(self.loop_handler_id)
+        self.loop_handler_id = 0
+        self.playing_handler_id = 0
+        self.metadata_handler_id = 0
+        self.peaks_handler_id = 0
+        self.progress_handler_id = 0
+        self.item = None
+
+    def on_progress_changed(self, item, pspec):
+        self.progress.props.percentage = item.props.progress
+
+    def on_loop_changed(self, item, pspec):
+        self.set_loop(item.props.loop)
+
+    def set_loop(self, loop):
+        self.loop_button.handler_block(self.loop_toggled_handler_id)
+        self.loop_button.props.active = loop
+        self.loop_button.handler_unblock(self.loop_toggled_handler_id)
+        self.loop_revealer.set_reveal_child(loop)
+
+    def on_loop_toggled(self, button):
+        if self.item is not None:
+            self.item.clip.set_loop(button.props.active)
+
+    def on_peaks_changed(self, item, pspec):
+        self.set_peaks(item.props.peaks)
+
+    def set_peaks(self, peaks):
+        self.icon_image.props.visible = peaks is None
+        self.waveform.props.visible = peaks is not None
+        self.waveform.queue_draw()
+
+    def on_waveform_draw(self, drawing_area, cr):
+        if self.item is None or self.item.props.peaks is None:
+            return Gdk.EVENT_PROPAGATE
+        peaks = self.item.props.peaks
+        width = drawing_area.get_allocated_width()
+        height = drawing_area.get_allocated_height()
+        middle = height / 2
+        step = width / len(peaks)
+
+        context = drawing_area.get_style_context()
+        Gdk.cairo_set_source_rgba(cr, context.get_color(context.get_state()))
+        cr.set_line_width(max(1, step * 0.6))
+        for index, (low, high) in enumerate(peaks):
+            x = (index + 0.5) * step
+            cr.move_to(x, middle - high * middle / 32768)
+            cr.line_to(x, middle - low * middle / 32768 + 1)
+        cr.stroke()
+        return Gdk.EVENT_STOP
 
-    # def on_keyboard_pressed(self, *args):
-    #     print(locals())
-    #     # self.player.play_pause()
+    def on_metadata_changed(self, item, pspec):
+        self.props.tooltip_text = item.get_description()
 
-    # def on_mouse_clicked(self, eventbox, eventbutton):
-    #     if eventbutton.button == 1:
-    #         self.player.play_pause()
+    def on_playing_changed(self, item, pspec):
+        self.set_playing(item.props.playing)
 
-    def on_enter_notify(self, widget, eventcrossing):
-        self.select_revealer.set_reveal_child(True)
-
-    def on_leave_notify(self, widget, eventcrossing):
-        if not self.get_parent().is_selected():
-            self.select_revealer.set_reveal_child(False)
+    def set_playing(self, playing):
+        self.play_revealer.set_reveal_child(playing)
+        if playing:
+            self.play_revealer.props.name = "soundclip-play"
+        else:
+            self.play_revealer.props.name = "soundclip-pause"
 
     def on_select_button(self, button):
         # print(button.props.name, "triggered at line: {0}, code_context: {1}".format(getframeinfo(currentframe()).lineno, getframeinfo(currentframe()).code_context))
-        if not self.get_parent().is_selected():
+        flowboxchild = self.get_parent().get_parent()
+        if not flowboxchild.is_selected():
             self.get_toplevel().on_select_mode()
-            self.get_toplevel().soundboard_view.select_child(self.get_parent())
+            self.get_toplevel().soundboard_view.select_child(flowboxchild)
         else:
-            self.get_toplevel().soundboard_view.unselect_child(self.get_parent())
+            self.get_toplevel().soundboard_view.unselect_child(flowboxchild)
             self.get_toplevel().on_select_mode()
 
 class ItemLabel(Gtk.Label):
@@ -422,27 +993,30 @@ class CompositedGrid(Gtk.Grid):
 class PoofItem(Gtk.Grid):
     ''' Ported from
     https://github.com/ricotz/plank/blob/master/lib/Widgets/PoofWindow.vala
+
+    The sprite strip is decoded once per scale factor and shared by every
+    instance, and the animation runs off the widget frame clock.
     '''
 
     RUN_LENGTH = 300 * 1000
+    POOF_PATH = os.path.join(os.path.dirname(__file__), "data", "poof.svg")
 
-    poof_image = None
+    sprites = {}
     poof_size = None
     poof_frames = None
-    
+
     start_time = 0
     frame_time = 0
-    
-    animation_timer_id = 0
+
+    animation_tick_id = 0
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        import math
-        
-        self.poof_image = GdkPixbuf.Pixbuf.new_from_file(os.path.join(os.path.dirname(__file__), "data", "poof.svg"))
-        self.poof_size = self.poof_image.props.width
-        self.poof_frames = math.floor(self.poof_image.props.height / self.poof_size)
+        if PoofItem.poof_size is None:
+            pixbuf_format, width, height = GdkPixbuf.Pixbuf.get_file_info(self.POOF_PATH)
+            PoofItem.poof_size = width
+            PoofItem.poof_frames = math.floor(height / width)
 
         self.set_size_request(self.poof_size, self.poof_size)
 
@@ -453,9 +1027,19 @@ class PoofItem(Gtk.Grid):
         self.attach(drawing_area, 0, 0, 1, 1)
         self.props.can_focus = False
 
+    @classmethod
+    def get_sprite(cls, scale_factor, window):
+        sprite = cls.sprites.get(scale_factor)
+        if sprite is None:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(cls.POOF_PATH, cls.poof_size * scale_factor, cls.poof_size * cls.poof_frames * scale_factor)
+            sprite = Gdk.cairo_surface_create_from_pixbuf(pixbuf, scale_factor, window)
+            cls.sprites[scale_factor] = sprite
+        return sprite
+
     def draw(self, drawing_area, cairo_context):
+        sprite = self.get_sprite(drawing_area.get_scale_factor(), drawing_area.get_window())
         cairo_context.set_operator(cairo.Operator.SOURCE)
-        Gdk.cairo_set_source_pixbuf(cairo_context, self.poof_image, 0, -self.poof_size * (self.poof_frames * (self.frame_time - self.start_time) / float(self.RUN_LENGTH)))
+        cairo_context.set_source_surface(sprite, 0, -self.poof_size * math.floor(self.poof_frames * (self.frame_time - self.start_time) / float(self.RUN_LENGTH)))
         cairo_context.paint()
 
         # cairo_context.save()
@@ -466,25 +1050,28 @@ class PoofItem(Gtk.Grid):
         return Gdk.EVENT_STOP
 
     def on_show(self):
-        if self.animation_timer_id > 0:
-            GLib.Source.remove(self.animation_timer_id)
+        if self.animation_tick_id > 0:
+            self.remove_tick_callback(self.animation_tick_id)
+            self.animation_tick_id = 0
 
-        if self.poof_image is None and self.poof_frames > 0:
+        if self.poof_frames == 0:
             return
-        
-        self.start_time = GLib.get_monotonic_time()
-        self.frame_time = self.start_time
+
+        self.start_time = 0
+        self.frame_time = 0
 
         self.show()
-        self.animation_timer_id = GLib.timeout_add(30, self.animate, None)
+        self.animation_tick_id = self.add_tick_callback(self.animate)
+
+    def animate(self, widget, frame_clock):
+        self.frame_time = frame_clock.get_frame_time()
+        if self.start_time == 0:
+            self.start_time = self.frame_time
 
-    def animate(self, data):
-        self.frame_time = GLib.get_monotonic_time()
-            
         if self.frame_time - self.start_time <= self.RUN_LENGTH:
             self.queue_draw()
-            return True
-        
-        self.animation_timer_id = 0
+            return GLib.SOURCE_CONTINUE
+
+        self.animation_tick_id = 0
         self.hide()
-        return False
\ No newline at end of file
+        return GLib.SOURCE_REMOVE